@@ -45,6 +45,9 @@ setup(
         'selenium', 'pytest-xdist', 'pytest-instafail', 'pytest', 'UnittestZero',
         'Jinja2', 'requests', 'Appium-Python-Client', 'Click>=6.0'
     ],
+    extras_require={
+        'visual': ['numpy', 'Pillow'],
+    },
     scripts=['shi'],
     entry_points={
         'console_scripts': [
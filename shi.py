@@ -1,3 +1,5 @@
 from shishito.shishito_runner import ShishitoRunner
 import os
-ShishitoRunner(os.getcwd()).run_tests()
+
+if __name__ == '__main__':
+    ShishitoRunner(os.getcwd()).run_tests()
@@ -2,9 +2,16 @@
 @author: Vojtech Burian
 @summary: Fixtures for handling custom pytest parameters
 """
+import os
+
 import pytest
 
 from shishito.reporting.junithtml import LogHTML
+from shishito.runtime.platform.shishito_control_test import get_worker_share, wait_for_background_tasks
+from shishito.runtime.screenshot_registry import COMBINATION_ENV
+from shishito.runtime.screenshot_writer import flush_screenshots
+from shishito.runtime.session_pool import session_pool
+from shishito.runtime.shishito_support import ShishitoSupport
 
 
 # CURRENT TEST INFO OBJECT #
@@ -125,20 +132,54 @@ def pytest_addoption(parser):
 def pytest_configure(config):
     htmlpath = config.option.htmlpath
     prefix = config.option.prefix
+    # screenshots are recorded with combination of the run (see screenshot_registry)
+    if prefix:
+        os.environ[COMBINATION_ENV] = prefix
+    else:
+        os.environ.pop(COMBINATION_ENV, None)
     # prevent opening xmllog on slave nodes (xdist)
     if htmlpath and not hasattr(config, 'slaveinput'):
         config._html = LogHTML(htmlpath, prefix)
         config.pluginmanager.register(config._html)
 
 
+@pytest.hookimpl(tryfirst=True)
+def pytest_sessionfinish(session):
+    # screenshots have to be written before the report copies them
+    flush_screenshots()
+
+
 def pytest_unconfigure(config):
+    # quit pooled webdriver sessions (atexit is not called in multiprocessing workers)
+    wait_for_background_tasks()
+    session_pool.close()
+    flush_screenshots()
+
     html = getattr(config, '_html', None)
     if html:
         del config._html
         config.pluginmanager.unregister(html)
 
 
+def prefetch_browsers(session):
+    # start browsers in background while fixtures are set up
+    config = session.config
+    is_worker = hasattr(config, 'workerinput') or hasattr(config, 'slaveinput')
+    if config.option.collectonly or (getattr(config.option, 'numprocesses', None) and not is_worker):
+        return
+
+    try:
+        shishito_support = ShishitoSupport()
+    except ValueError:  # not a shishito project
+        return
+    if int(shishito_support.get_opt('browser_prefetch') or 0):
+        shishito_support.get_test_control().prefetch_browsers()
+
+
 def pytest_collection_finish(session):
+    # do not prefetch more browsers than there are test classes to run (split between xdist workers)
+    session_pool.start_limit = get_worker_share(len(set(i.cls for i in session.items)))
+
     test_names = {}
     for i in session.items:
         name, module = i.name, i.cls.__module__
@@ -146,6 +187,8 @@ def pytest_collection_finish(session):
             raise Exception("You should rename duplicate test method: '%s'. It was found in modules: '%s' and '%s'"%(name, module, test_names[name]))
         test_names[name] = module
 
+    prefetch_browsers(session)
+
 
 @pytest.hookimpl(hookwrapper=True)
 def pytest_runtest_makereport(item, call):
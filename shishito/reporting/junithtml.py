@@ -20,6 +20,8 @@ from py.xml import raw
 
 from html import escape
 
+from shishito.runtime.screenshot_registry import get_screenshot_registry
+
 
 def find_urls(text):
     return re.findall('http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\(\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', text)
@@ -46,6 +48,7 @@ class LogHTML(object):
         self.passed = self.skipped = 0
         self.xfailed = self.xpassed = 0
         self.resources = ('style.css', 'jquery.js', 'main.js')
+        self.suite_start_time = time.time()
 
     def _make_report_dir(self):
         logfile_dirname = os.path.dirname(self.logfile)
@@ -361,21 +364,19 @@ class LogHTML(object):
         log.append(xfail_p)
 
     def _append_screenshot(self, name, log):
-        name = re.sub('[^A-Za-z0-9_.]+', '_', name)
-
-        images_saved = os.path.join(self.project_root, 'screenshots')
+        # screenshots taken in this test during this test run of this combination
+        registry = get_screenshot_registry(os.path.join(self.project_root, 'screenshots'))
+        screenshots = registry.get_test_screenshots(name, since=self.suite_start_time, combination=self.prefix)
 
-        if os.path.isdir(images_saved) and len(os.listdir(images_saved)) > 0:
+        if screenshots:
 
             log.append(html.h3('Screenshots'))
 
-            for file in os.listdir(images_saved):
-                image_path = os.path.join(images_saved, file)
-                if name in image_path:
-                    self.used_screens.append(image_path)
-                    # use relative path in img src
-                    source = image_path.replace(self.project_root, '.')
-                    log.append(source)
-                    log.append(html.br())
-                    log.append(html.img(src=source))
-                    log.append(html.br())
+            for image_path in screenshots:
+                self.used_screens.append(image_path)
+                # use relative path in img src
+                source = image_path.replace(self.project_root, '.')
+                log.append(source)
+                log.append(html.br())
+                log.append(html.img(src=source))
+                log.append(html.br())
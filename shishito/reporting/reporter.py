@@ -3,9 +3,12 @@ import os
 import shutil
 import time
 import xml.etree.ElementTree as ET
+import zipfile
 
 from jinja2 import Environment, FileSystemLoader
 
+from shishito.runtime.scheduling import get_result_config_section
+from shishito.runtime.screenshot_registry import get_screenshot_registry
 from shishito.runtime.shishito_support import ShishitoSupport
 
 
@@ -18,11 +21,12 @@ class Reporter(object):
         self.result_folder = os.path.join(self.project_root, 'results', self.timestamp)
 
     def cleanup_results(self):
-        """ Cleans up test result folder """
+        """ Cleans up test result folder and records of deleted screenshots """
         if os.path.exists(os.path.join(self.project_root, 'results')):
             shutil.rmtree(os.path.join(self.project_root, 'results'))
         os.makedirs(self.result_folder)
         os.symlink(self.timestamp, os.path.join(self.project_root, 'results', 'current'))
+        get_screenshot_registry(os.path.join(self.project_root, 'screenshots')).prune()
 
     def archive_results(self):
         """ Archives test results in zip package """
@@ -32,9 +36,30 @@ class Reporter(object):
         shutil.make_archive(os.path.join(archive_folder, self.timestamp), "zip",
                             os.path.join(self.project_root, 'results'))
 
-    def generate_combined_report(self):
+    def merge_results(self, result_folders):
+        """ Copies results of other test runs (e.g. shards running on other CI nodes) into result folder
+
+        :param list result_folders: result folders (results/<timestamp>) of the runs to be merged
+        """
+        for result_folder in result_folders:
+            for root, dirs, files in os.walk(result_folder):
+                destination = os.path.join(self.result_folder, os.path.relpath(root, result_folder))
+                if not os.path.exists(destination):
+                    os.makedirs(destination)
+                for file_name in files:
+                    if file_name != 'CombinedReport.html':
+                        shutil.copy(os.path.join(root, file_name), destination)
+
+    def generate_combined_report(self, merge_folders=None):
+        """ Generates report combining html reports of all combinations
+
+        :param list merge_folders: result folders of other runs (shards) to be merged into the report
+        """
+        if merge_folders:
+            self.merge_results(merge_folders)
+
         data = os.listdir(os.path.join(self.project_root, 'results', self.timestamp))
-        result_reports = [item[:-5] for item in data if item.endswith('.html')]
+        result_reports = sorted(item[:-5] for item in data if item.endswith('.html') and item != 'CombinedReport.html')
 
         if not result_reports:
             return
@@ -55,38 +80,90 @@ class Reporter(object):
             os.path.join(self.project_root, 'results', self.timestamp)
         )
 
-    def get_xunit_test_cases(self, timestamp):
+    def get_xunit_test_cases(self, timestamp, skip_invalid=False):
         """ Parses test names and results from xUnit result file
 
+        :param timestamp: timestamp of the test run (name of the result folder)
+        :param skip_invalid: skip result files which can not be parsed (e.g. of crashed combination)
         :return: Dictionary of test-case (name, result) for each report file """
         result_folder = os.path.join(self.project_root, 'results', timestamp)
-        files = glob.glob(os.path.join(result_folder, '*.xml'))
         test_cases = []
-        for result_file in files:
-            case = {'name': os.path.basename(result_file), 'cases': []}
-            tree = ET.parse(result_file)
-            root = tree.getroot()
-            for child in root[0]:
-                if child.tag == 'testcase':
-                    # Test case class is converted from 'tests.something.TestMyClass' => 'MyClass'
-                    entry = {'name': child.get('name'),
-                             'class': child.get('classname').split('.')[-1].replace('Test', '', 1)}
-                    result = 'success'
-                    failure_message = ''
-                    for subChild in child:
-                        if failure_message != '': failure_message += '\n'
-                        failure_message += subChild.text or ''
-                        if subChild.tag == 'failure' and result == 'success':
-                            result = 'failure'
-                        elif subChild.tag == 'error' and result == 'success':
-                            result = 'error'
-                        elif subChild.tag == 'skipped' and result == 'success':
-                            result = 'skipped'
-                    entry['result'] = result
-                    if result == 'success':
-                        entry['failure_message'] = None
-                    else:
-                        entry['failure_message'] = failure_message
-                    case['cases'].append(entry)
-            test_cases.append(case)
+        for result_file in glob.glob(os.path.join(result_folder, '*.xml')):
+            try:
+                test_cases.append(self.parse_xunit_file(os.path.basename(result_file), result_file))
+            except ET.ParseError as e:
+                if not skip_invalid:
+                    raise
+                print('Unable to parse result file %s: %s' % (result_file, e))
+        return test_cases
+
+    def parse_xunit_file(self, name, result_file):
+        """ Parses test names and results from single xUnit result file
+
+        :param name: name of the report file
+        :param result_file: path to the report file or file object
+        :return: Dictionary of test-case (name, result) for the report file """
+        case = {'name': name, 'cases': []}
+        tree = ET.parse(result_file)
+        root = tree.getroot()
+        for child in root[0]:
+            if child.tag == 'testcase':
+                # Test case class is converted from 'tests.something.TestMyClass' => 'MyClass'
+                entry = {'name': child.get('name'),
+                         'classname': child.get('classname') or '',
+                         'class': child.get('classname').split('.')[-1].replace('Test', '', 1),
+                         'duration': float(child.get('time') or 0)}
+                result = 'success'
+                failure_message = ''
+                for subChild in child:
+                    if failure_message != '': failure_message += '\n'
+                    failure_message += subChild.text or ''
+                    if subChild.tag == 'failure' and result == 'success':
+                        result = 'failure'
+                    elif subChild.tag == 'error' and result == 'success':
+                        result = 'error'
+                    elif subChild.tag == 'skipped' and result == 'success':
+                        result = 'skipped'
+                entry['result'] = result
+                if result == 'success':
+                    entry['failure_message'] = None
+                else:
+                    entry['failure_message'] = failure_message
+                case['cases'].append(entry)
+        return case
+
+    def get_previous_test_cases(self):
+        """ Parses test results of previous test run, from results/current folder or (if it does not exist)
+        from the latest archive in results_archive folder. Must be called before results are cleaned up.
+
+        :return: Dictionary of test-case (name, result) for each report file of previous run """
+        current_folder = os.path.join(self.project_root, 'results', 'current')
+        if os.path.isdir(current_folder):
+            files = glob.glob(os.path.join(current_folder, '*.xml'))
+            return [self.parse_xunit_file(os.path.basename(result_file), result_file) for result_file in files]
+
+        archives = sorted(glob.glob(os.path.join(self.project_root, 'results_archive', '*.zip')))
+        if not archives:
+            return []
+
+        test_cases = []
+        with zipfile.ZipFile(archives[-1]) as archive:
+            for member in archive.namelist():
+                # archive contains <timestamp>/<result>.xml (and 'current' symlink)
+                if member.endswith('.xml') and not member.startswith('current/'):
+                    with archive.open(member) as result_file:
+                        test_cases.append(self.parse_xunit_file(os.path.basename(member), result_file))
         return test_cases
+
+    def get_failed_tests(self):
+        """ Returns tests that failed in previous test run for each combination
+
+        :return: Dictionary {config section: [(classname, name) of failed test cases]} """
+        failed_tests = {}
+        for run in self.get_previous_test_cases():
+            config_section = get_result_config_section(os.path.splitext(run['name'])[0])
+            failed_tests.setdefault(config_section, [])
+            for case in run['cases']:
+                if case['result'] in ('failure', 'error'):
+                    failed_tests[config_section].append((case['classname'], case['name']))
+        return failed_tests
@@ -0,0 +1,114 @@
+"""
+@summary: Cache of collected test ids, reused by following test runs until test files change
+"""
+import hashlib
+import json
+import os
+
+# folder in project root where shishito keeps data between runs
+CACHE_FOLDER = '.shishito_cache'
+
+# files next to tests that can change result of the collection
+COLLECTION_CONFIG_FILES = ('conftest.py', 'pytest.ini', 'tox.ini', 'setup.cfg', 'pyproject.toml')
+
+
+class CollectionCache(object):
+    """ Stores node IDs of collected tests, so that the runner does not need separate collection run to select
+    tests of combinations (shards, last failed tests) while test files stay the same. Cached collection is valid as long as test files and collection options stay the same.
+    Test files are identified by mtime and size, file hash is recomputed only for files that were touched.
+
+    :param str project_root: test project root
+    :param str test_directory: directory with tests (relative to project root)
+    """
+
+    def __init__(self, project_root, test_directory):
+        self.project_root = project_root
+        self.test_directory = test_directory
+        self.cache_file = os.path.join(project_root, CACHE_FOLDER, 'collection.json')
+
+        self.files = None
+        self.key = None
+
+    def get_test_files(self):
+        """ Return paths (relative to project root) of files that influence test collection.
+
+        :return: sorted list of file paths
+        """
+
+        test_files = [name for name in COLLECTION_CONFIG_FILES
+                      if os.path.isfile(os.path.join(self.project_root, name))]
+
+        for root, dirs, files in os.walk(os.path.join(self.project_root, self.test_directory)):
+            dirs[:] = [name for name in dirs if not name.startswith('.') and name != '__pycache__']
+            for name in files:
+                if name.endswith('.py') or name in COLLECTION_CONFIG_FILES:
+                    test_files.append(os.path.relpath(os.path.join(root, name), self.project_root))
+
+        return sorted(set(test_files))
+
+    def load(self):
+        """ Load cache file.
+
+        :return: dict with cached data (empty if there is no usable cache)
+        """
+
+        try:
+            with open(self.cache_file) as cache_file:
+                return json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def fingerprint(self, cached_files, options):
+        """ Compute fingerprint of test files and collection options.
+
+        :param dict cached_files: file fingerprints from previous run (path -> mtime, size, sha1)
+        :param list options: pytest options that influence collection (markers, keyword expression, ..)
+        :return: tuple (dict with file fingerprints, str cache key)
+        """
+
+        files = {}
+        key = hashlib.sha1(json.dumps(options).encode('utf-8'))
+
+        for path in self.get_test_files():
+            stat = os.stat(os.path.join(self.project_root, path))
+            cached = cached_files.get(path, {})
+            if cached.get('mtime') == stat.st_mtime and cached.get('size') == stat.st_size:
+                file_hash = cached['sha1']
+            else:
+                with open(os.path.join(self.project_root, path), 'rb') as test_file:
+                    file_hash = hashlib.sha1(test_file.read()).hexdigest()
+
+            files[path] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'sha1': file_hash}
+            key.update(('%s:%s\n' % (path, file_hash)).encode('utf-8'))
+
+        return files, key.hexdigest()
+
+    def get(self, options):
+        """ Return cached collection if test files did not change since it was stored.
+
+        :param list options: pytest options that influence collection
+        :return: dict with 'rootdir' and 'test_ids' or None
+        """
+
+        cache = self.load()
+        self.files, self.key = self.fingerprint(cache.get('files', {}), options)
+
+        if cache.get('key') == self.key:
+            return cache['collection']
+        return None
+
+    def store(self, collection):
+        """ Store collection for key computed by last get() call.
+
+        :param dict collection: dict with 'rootdir' (relative to project root) and list of 'test_ids'
+        """
+
+        if self.key is None:
+            raise ValueError('Collection cache key was not computed, call get() first.')
+
+        cache_folder = os.path.dirname(self.cache_file)
+        if not os.path.exists(cache_folder):
+            os.makedirs(cache_folder)
+
+        with open(self.cache_file, 'w') as cache_file:
+            json.dump({'key': self.key, 'files': self.files, 'collection': collection}, cache_file)
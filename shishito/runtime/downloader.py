@@ -0,0 +1,230 @@
+"""
+@summary: Download engine shared by file downloads of tests and services (CircleCI artifacts, ...).
+Pooled connections, large chunks, parallel downloads, resume of interrupted downloads (HTTP Range)
+and skipping of files which are already downloaded.
+"""
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CHUNK_SIZE = 1024 * 1024
+PARTIAL_SUFFIX = '.part'
+# validator (ETag / Last-Modified) of the file being downloaded into .part file
+VALIDATOR_SUFFIX = '.part.json'
+MANIFEST_FILE = '.downloads.json'
+
+
+def get_file_checksum(file_path, algorithm='sha256'):
+    """ Return hex digest of file content.
+
+    :param str file_path: path to file
+    :param str algorithm: hashlib algorithm name
+    :return: str
+    """
+
+    checksum = hashlib.new(algorithm)
+    with open(file_path, 'rb') as checked_file:
+        for block in iter(lambda: checked_file.read(CHUNK_SIZE), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+class Downloader(object):
+    """ Downloads files over pooled HTTP connections.
+
+    Data are streamed into '<file>.part' which is renamed when the download is complete, so interrupted download
+    is resumed by Range request next time. Validator of the file (ETag or Last-Modified) is stored next to the
+    .part file and sent in If-Range header, so the download starts over if the file changed since. Optionally, checksum of downloaded file is recorded with ETag
+    of the response in manifest file of the folder (.downloads.json); file with unchanged checksum and ETag
+    is not downloaded again.
+
+    :param int max_workers: max number of parallel downloads (and pooled connections)
+    :param int chunk_size: size of chunks read from response
+    :param requests.Session session: session to use (e.g. with authentication), new one by default
+     (default session does not keep cookies, it is shared by unrelated downloads)
+    """
+
+    def __init__(self, max_workers=4, chunk_size=CHUNK_SIZE, session=None):
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        if session is None:
+            session = requests.Session()
+            session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self.session = session
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.manifest_lock = threading.Lock()
+
+    @staticmethod
+    def get_manifest_path(file_path):
+        return os.path.join(os.path.dirname(os.path.abspath(file_path)), MANIFEST_FILE)
+
+    def load_manifest(self, file_path):
+        try:
+            with open(self.get_manifest_path(file_path)) as manifest_file:
+                return json.load(manifest_file)
+        except (IOError, ValueError):
+            return {}
+
+    def record_download(self, file_path, etag, checksum):
+        """ Store checksum and ETag of downloaded file into manifest of its folder. """
+
+        with self.manifest_lock:
+            manifest = self.load_manifest(file_path)
+            manifest[os.path.basename(file_path)] = {'etag': etag, 'sha256': checksum}
+
+            manifest_path = self.get_manifest_path(file_path)
+            with open(manifest_path + '.tmp', 'w') as manifest_file:
+                json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+            os.replace(manifest_path + '.tmp', manifest_path)
+
+    @staticmethod
+    def get_validator(response):
+        """ Return value for If-Range header identifying version of the file in response (None if there is none). """
+
+        etag = response.headers.get('ETag')
+        if etag and not etag.startswith('W/'):  # weak ETags can not be used in If-Range
+            return etag
+        return response.headers.get('Last-Modified')
+
+    @staticmethod
+    def load_validator(url, file_path):
+        """ Return validator of partially downloaded file, None if download of the url can not be resumed. """
+
+        try:
+            with open(file_path + VALIDATOR_SUFFIX) as validator_file:
+                state = json.load(validator_file)
+        except (IOError, ValueError):
+            return None
+        return state.get('validator') if state.get('url') == url else None
+
+    @staticmethod
+    def save_validator(url, file_path, validator):
+        """ Store validator of file being downloaded (remove it if validator is None). """
+
+        validator_path = file_path + VALIDATOR_SUFFIX
+        if validator:
+            with open(validator_path, 'w') as validator_file:
+                json.dump({'url': url, 'validator': validator}, validator_file)
+        elif os.path.exists(validator_path):
+            os.remove(validator_path)
+
+    def is_downloaded(self, url, file_path, checksum=None, params=None, manifest=False):
+        """ Return True if file is already downloaded - it has expected checksum, or its checksum and ETag
+        of the url match the manifest.
+
+        :param str url: url of the file
+        :param str file_path: path of the downloaded file
+        :param str checksum: expected sha256 of the file (if known)
+        :param dict params: query parameters of the request
+        :param bool manifest: check the manifest of the folder
+        """
+
+        if not os.path.isfile(file_path):
+            return False
+        if checksum:
+            return get_file_checksum(file_path) == checksum
+        if not manifest:
+            return False
+
+        record = self.load_manifest(file_path).get(os.path.basename(file_path))
+        if not record or not record.get('etag') or get_file_checksum(file_path) != record['sha256']:
+            return False
+
+        response = self.session.head(url, params=params, allow_redirects=True)
+        return response.ok and response.headers.get('ETag') == record['etag']
+
+    def download(self, url, file_path, checksum=None, params=None, manifest=False):
+        """ Download url into file. Interrupted download is resumed, file already downloaded is skipped.
+
+        :param str url: url of the file
+        :param str file_path: path where to save the file
+        :param str checksum: expected sha256 of the file (if known)
+        :param dict params: query parameters of the request (e.g. token)
+        :param bool manifest: skip file recorded in manifest of the folder (checksum and ETag), record the download
+        :return: True if file was downloaded, False if it was already downloaded
+        :raises requests.HTTPError: if request fails
+        :raises ValueError: if downloaded file does not have expected checksum
+        """
+
+        if self.is_downloaded(url, file_path, checksum, params, manifest):
+            return False
+
+        partial_path = file_path + PARTIAL_SUFFIX
+        # partial file can be resumed only if we know which version of the file it belongs to
+        validator = self.load_validator(url, file_path)
+        offset = os.path.getsize(partial_path) if validator and os.path.isfile(partial_path) else 0
+        # ranges and checksums refer to raw (not compressed) content
+        headers = {'Accept-Encoding': 'identity'}
+        if offset:
+            headers['Range'] = 'bytes=%d-' % offset
+            # whole file (200) is sent instead of the range if it changed since the partial download
+            headers['If-Range'] = validator
+
+        response = self.session.get(url, params=params, headers=headers, stream=True)
+        if response.status_code == 416:
+            # partial file is not valid for current version of the file
+            response.close()
+            offset = 0
+            del headers['Range'], headers['If-Range']
+            response = self.session.get(url, params=params, headers=headers, stream=True)
+        response.raise_for_status()
+
+        with response:
+            resumed = offset and response.status_code == 206
+            if not resumed:
+                # new download (file changed or server does not support ranges) - start over
+                self.save_validator(url, file_path, self.get_validator(response))
+            with open(partial_path, 'ab' if resumed else 'wb') as partial_file:
+                for block in response.iter_content(self.chunk_size):
+                    partial_file.write(block)
+            etag = response.headers.get('ETag')
+
+        self.save_validator(url, file_path, None)
+        downloaded_checksum = get_file_checksum(partial_path)
+        if checksum and downloaded_checksum != checksum:
+            os.remove(partial_path)
+            raise ValueError('Checksum of downloaded file %s does not match (%s != %s)'
+                             % (file_path, downloaded_checksum, checksum))
+
+        os.replace(partial_path, file_path)
+        if manifest:
+            self.record_download(file_path, etag, downloaded_checksum)
+        return True
+
+    def download_all(self, downloads):
+        """ Download files in parallel (max_workers at once).
+
+        :param list downloads: list of dicts with download() arguments (url, file_path, checksum, params, manifest)
+        :return: list of download() results
+        :raises Exception: first error of the downloads, after all downloads finish
+        """
+
+        if not downloads:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(downloads))) as executor:
+            futures = [executor.submit(self.download, **download) for download in downloads]
+        return [future.result() for future in futures]
+
+
+downloader = None
+downloader_lock = threading.Lock()
+
+
+def get_downloader():
+    """ Return downloader shared by the process. """
+
+    global downloader
+
+    with downloader_lock:
+        if downloader is None:
+            downloader = Downloader()
+        return downloader
@@ -1,3 +1,4 @@
+import copy
 import inspect
 import os
 import re
@@ -6,6 +7,7 @@ import base64
 from selenium import webdriver
 import json
 from shishito.runtime.all_content_type import content_types
+from shishito.runtime.firefox_profile import get_firefox_profile
 
 OPTIONS = 'OPTIONS'
 ARGUMENTS = 'ARGUMENTS'
@@ -26,6 +28,34 @@ BROWSER_KEYWORDS = {  # map lowercase browser name to option keyword understood
 }
 
 
+# caches shared by all environment objects of the process (new one is created for every test class)
+capabilities_cache = {}
+encoded_extensions = {}
+
+
+def get_file_fingerprint(path):
+    """ Return tuple identifying content of the file (path, modification time, size). """
+
+    stat = os.stat(path)
+    return path, stat.st_mtime, stat.st_size
+
+
+def get_encoded_extension(path):
+    """ Return base64-encoded content of extension file. File is read and encoded only once until it changes.
+
+    :param str path: path to extension file
+    :return: str
+    """
+
+    fingerprint = get_file_fingerprint(path)
+    extension_base64 = encoded_extensions.get(fingerprint)
+    if extension_base64 is None:
+        with open(path, 'rb') as ext_file:
+            extension_base64 = base64.b64encode(ext_file.read()).decode('UTF-8')
+        encoded_extensions[fingerprint] = extension_base64
+    return extension_base64
+
+
 class ShishitoEnvironment(object):
     """ Base class for test environment. """
 
@@ -177,9 +207,7 @@ class ShishitoEnvironment(object):
                 return
 
             for extension in extensions:
-                with open(extension, 'rb') as ext_file:
-                    extension_base64 = base64.b64encode(ext_file.read()).decode('UTF-8')
-                browser_capabilities[options_kw][exts_kw].append(extension_base64)
+                browser_capabilities[options_kw][exts_kw].append(get_encoded_extension(extension))
 
     def add_experimental_option(self, browser_capabilities, config_section):
         browser_name = self.shishito_support.get_opt(config_section, 'browser').lower()
@@ -196,6 +224,13 @@ class ShishitoEnvironment(object):
         """ Start webdriver for given config section."""
         raise NotImplementedError()
 
+    def release_browser(self, driver):
+        """ Called after driver was quit. Frees resources held for the driver (e.g. remote session slots).
+
+        :param WebDriver driver: driver that was quit
+        """
+        pass
+
     def get_capabilities(self, config_section):
         """ Return dictionary of capabilities for specific config combination/
 
@@ -213,6 +248,26 @@ class ShishitoEnvironment(object):
                    "extensions" : [ "base64-xxxxx" ]
                 }
              }
+        Capabilities are built only once for config section (and its extension files) and copied,
+        encoded extensions are shared by the copies.
+        """
+
+        extensions = tuple(get_file_fingerprint(ext) for ext in self.get_browser_extensions(config_section))
+        key = (type(self), self.shishito_support.test_platform, config_section, extensions)
+
+        capabilities = capabilities_cache.get(key)
+        if capabilities is None:
+            capabilities = self.build_capabilities(config_section)
+            capabilities_cache[key] = capabilities
+
+        # strings (encoded extensions) are not copied
+        return copy.deepcopy(capabilities)
+
+    def build_capabilities(self, config_section):
+        """ Build dictionary of capabilities for specific config combination (see get_capabilities).
+
+        :param str config_section: section in platform/environment.properties config
+        :return: dict with capabilities
         """
         get_opt = self.shishito_support.get_opt
         test_platform = self.shishito_support.test_platform
@@ -266,25 +321,43 @@ class ShishitoEnvironment(object):
         profile = None
 
         if browser_type == 'firefox':
-            profile = webdriver.FirefoxProfile()
+            # profile is built once and cloned for each driver
+            extensions = tuple(get_file_fingerprint(ext) for ext in self.get_browser_extensions(config_section))
             try:
                 download_file_path = self.shishito_support.get_opt('download_path')
-                if download_file_path:
-                    profile.set_preference("browser.download.folderList", 2)
-                    profile.set_preference("browser.download.manager.showWhenStarting", False)
-                    profile.set_preference("browser.download.dir", download_file_path)
-                    profile.set_preference("browser.helperApps.neverAsk.saveToDisk", content_types)
-                    profile.set_preference("browser.helperApps.alwaysAsk.force", False)
-                    profile.set_preference("browser.download.manager.useWindow", False)
-                    profile.set_preference("browser.download.manager.focusWhenStarting", False)
-                    profile.set_preference("browser.helperApps.neverAsk.openFile", True)
-                    profile.set_preference("browser.download.manager.showAlertOnComplete", False)
-                    profile.set_preference("browser.download.manager.closeWhenDone", True)
             except configparser.NoOptionError:
-                pass
+                download_file_path = None
+            key = (config_section, download_file_path, extensions)
+            profile = get_firefox_profile(key, lambda: self.build_firefox_profile(config_section))
+
+        return profile
+
+    def build_firefox_profile(self, config_section=None):
+        """ Create Firefox profile with download preferences and browser extensions.
+
+        :param str config_section: section in platform/environment.properties config
+        :return: FirefoxProfile
+        """
+
+        profile = webdriver.FirefoxProfile()
+        try:
+            download_file_path = self.shishito_support.get_opt('download_path')
+            if download_file_path:
+                profile.set_preference("browser.download.folderList", 2)
+                profile.set_preference("browser.download.manager.showWhenStarting", False)
+                profile.set_preference("browser.download.dir", download_file_path)
+                profile.set_preference("browser.helperApps.neverAsk.saveToDisk", content_types)
+                profile.set_preference("browser.helperApps.alwaysAsk.force", False)
+                profile.set_preference("browser.download.manager.useWindow", False)
+                profile.set_preference("browser.download.manager.focusWhenStarting", False)
+                profile.set_preference("browser.helperApps.neverAsk.openFile", True)
+                profile.set_preference("browser.download.manager.showAlertOnComplete", False)
+                profile.set_preference("browser.download.manager.closeWhenDone", True)
+        except configparser.NoOptionError:
+            pass
 
-            for ext in self.get_browser_extensions(config_section):
-                profile.add_extension(ext)
+        for ext in self.get_browser_extensions(config_section):
+            profile.add_extension(ext)
 
         return profile
 
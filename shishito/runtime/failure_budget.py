@@ -0,0 +1,91 @@
+"""
+@summary: Failure budget shared by all combinations of the test run (run-wide --maxfail)
+"""
+from shishito.runtime.shared_state import SharedState
+
+
+class FailureBudget(object):
+    """ Counts failures of all pytest runs (combinations, xdist workers) of the test run.
+
+    :param str state_file: path to file with failure count shared by all processes
+    :param int budget: max number of failures, after which no new tests are started
+    """
+
+    def __init__(self, state_file, budget):
+        self.state = SharedState(state_file)
+        self.budget = int(budget)
+
+    def record_failure(self):
+        """ Add failure to the run-wide count.
+
+        :return: int with number of failures
+        """
+
+        def increment(state):
+            state['failures'] = state.get('failures', 0) + 1
+            return state['failures']
+
+        return self.state.update(increment)
+
+    def get_failures(self):
+        """ Return number of failures recorded so far. """
+
+        return self.state.read().get('failures', 0)
+
+    def is_spent(self):
+        """ Return True if the number of failures reached the budget. """
+
+        return self.get_failures() >= self.budget
+
+
+class FailureBudgetPlugin(object):
+    """ Pytest plugin recording failures into the failure budget and stopping the session once it is spent.
+    Registered only in pytest controller process (xdist workers send their reports to the controller).
+
+    :param FailureBudget failure_budget: failure budget of the test run
+    """
+
+    def __init__(self, failure_budget):
+        self.failure_budget = failure_budget
+        self.session = None
+
+    def stop(self):
+        message = 'Failure budget of the test run (%s failures) is spent' % self.failure_budget.budget
+        self.session.shouldstop = message
+
+        # xdist controller decides about sending new tests to workers on its own
+        dsession = self.session.config.pluginmanager.getplugin('dsession')
+        if dsession is not None:
+            dsession.shouldstop = message
+
+    def pytest_sessionstart(self, session):
+        self.session = session
+
+    def pytest_collection_modifyitems(self, config, items):
+        # budget was spent by other combination in the meantime
+        if self.failure_budget.is_spent():
+            config.hook.pytest_deselected(items=items[:])
+            del items[:]
+
+    def pytest_runtest_logreport(self, report):
+        if report.failed:
+            self.failure_budget.record_failure()
+
+        if self.failure_budget.is_spent():
+            self.stop()
+
+
+def pytest_addoption(parser):
+    parser.addoption('--failure_budget', action="store", default=None,
+                     help="Max number of failures of the whole test run (all combinations)")
+    parser.addoption('--failure_budget_file', action="store", default=None,
+                     help="File with failure count shared by all combinations of the test run")
+
+
+def pytest_configure(config):
+    budget = config.getoption('failure_budget')
+    budget_file = config.getoption('failure_budget_file')
+    is_worker = hasattr(config, 'workerinput') or hasattr(config, 'slaveinput')
+
+    if budget and budget_file and not is_worker:
+        config.pluginmanager.register(FailureBudgetPlugin(FailureBudget(budget_file, budget)), 'failure_budget')
@@ -0,0 +1,129 @@
+"""
+@summary: Waiting for files (e.g. browser downloads). Uses inotify on Linux, so waiting ends as soon as the file
+is created or renamed to its final name; elsewhere the files are polled.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import time
+
+# suffixes of files being downloaded (chrome, firefox, safari); download of file.txt is complete
+# when file.txt exists and none of file.txt<suffix> exists
+PARTIAL_SUFFIXES = ('.crdownload', '.part', '.download')
+
+# inotify constants (see inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+def is_file_complete(file_path):
+    """ Return True if file exists and it is not being downloaded. """
+
+    if not os.path.exists(file_path):
+        return False
+    return not any(os.path.exists(file_path + suffix) for suffix in PARTIAL_SUFFIXES)
+
+
+class InotifyWatcher(object):
+    """ Watches directories for created, renamed and deleted files (Linux only).
+
+    :param list directories: directories to watch
+    :raises OSError: if inotify is not available or directory can not be watched
+    """
+
+    libc = None
+
+    def __init__(self, directories):
+        if InotifyWatcher.libc is None:
+            if not sys.platform.startswith('linux'):
+                raise OSError('inotify is available only on Linux')
+            InotifyWatcher.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+        try:
+            for directory in directories:
+                if self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK) < 0:
+                    errno = ctypes.get_errno()
+                    raise OSError(errno, 'Can not watch directory: ' + os.strerror(errno), directory)
+        except OSError:
+            self.close()
+            raise
+
+    def wait(self, timeout):
+        """ Wait until some change happens in watched directories.
+
+        :param float timeout: max seconds to wait
+        :return: True if there was a change, False on timeout
+        """
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+
+        # drop events, callers check the files themselves
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+
+def wait_for_files(file_paths, timeout, poll_interval=0.5):
+    """ Wait until all files exist and are not being downloaded.
+
+    Changes of local directories are watched by inotify (where available). Files are still checked
+    at least every poll_interval seconds, because changes of remote (network) folders do not produce events.
+
+    :param list file_paths: paths of files to wait for
+    :param float timeout: seconds to wait
+    :param float poll_interval: max seconds between checks of the files
+    :return: list of files which are still missing after timeout (empty if all files are complete)
+    """
+
+    pending = set(os.path.abspath(path) for path in file_paths)
+    deadline = time.monotonic() + timeout
+    directories = set(os.path.dirname(path) for path in pending)
+
+    try:
+        watcher = InotifyWatcher(directories)
+    except OSError:
+        watcher = None
+
+    try:
+        while True:
+            pending = set(path for path in pending if not is_file_complete(path))
+            remaining = deadline - time.monotonic()
+            if not pending or remaining <= 0:
+                return sorted(pending)
+
+            if watcher:
+                watcher.wait(min(poll_interval, remaining))
+            else:
+                time.sleep(min(poll_interval, remaining))
+    finally:
+        if watcher:
+            watcher.close()
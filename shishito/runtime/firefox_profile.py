@@ -0,0 +1,122 @@
+"""
+@summary: Firefox profiles cloned from templates built once per process
+"""
+import atexit
+import os
+import shutil
+import threading
+
+from selenium import webdriver
+
+# files of profile which are never modified in place (by selenium or firefox) and can be shared by hard link
+SHARED_FOLDERS = ('extensions',)
+
+profile_templates = {}
+templates_lock = threading.Lock()
+
+
+def link_or_copy(source, destination):
+    """ Hard link file, or copy it where hard links are not supported (e.g. different file system). """
+
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def clone_profile_folder(template_folder, destination):
+    """ Create copy of profile folder. Files of SHARED_FOLDERS are hard linked, others copied.
+
+    :param str template_folder: folder of template profile
+    :param str destination: new profile folder (must not exist)
+    """
+
+    ignore = shutil.ignore_patterns('parent.lock', 'lock', '.parentlock')
+    shutil.copytree(template_folder, destination, ignore=ignore)
+
+    for folder in SHARED_FOLDERS:
+        shared_folder = os.path.join(destination, folder)
+        if os.path.isdir(shared_folder):
+            shutil.rmtree(shared_folder)
+            shutil.copytree(os.path.join(template_folder, folder), shared_folder, ignore=ignore,
+                            copy_function=link_or_copy)
+
+
+class ProfileTemplate(object):
+    """ Firefox profile with preferences written and extensions installed, used for cloning profiles
+    of new drivers. Encoded (zipped) profile is computed only once.
+
+    :param FirefoxProfile profile: configured profile
+    """
+
+    def __init__(self, profile):
+        profile.update_preferences()
+        self.profile = profile
+        self.path = profile.path
+        self.preferences = dict(profile.default_preferences)
+        self.encoded = None
+        self.lock = threading.Lock()
+
+    def get_encoded(self):
+        with self.lock:
+            if self.encoded is None:
+                self.encoded = self.profile.encoded
+            return self.encoded
+
+    def clone(self):
+        return ClonedFirefoxProfile(self)
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+class ClonedFirefoxProfile(webdriver.FirefoxProfile):
+    """ Firefox profile created from ProfileTemplate. Until preferences or extensions are changed,
+    encoded profile of the template is used.
+
+    :param ProfileTemplate template: template of the profile
+    """
+
+    def __init__(self, template):
+        super(ClonedFirefoxProfile, self).__init__()
+        self.template = template
+        self.extensions_added = False
+
+        shutil.rmtree(self.profile_dir)
+        clone_profile_folder(template.path, self.profile_dir)
+        self.default_preferences = dict(template.preferences)
+
+    def add_extension(self, *args, **kwargs):
+        self.extensions_added = True
+        super(ClonedFirefoxProfile, self).add_extension(*args, **kwargs)
+
+    @property
+    def encoded(self):
+        if not self.extensions_added and self.default_preferences == self.template.preferences:
+            return self.template.get_encoded()
+        return super(ClonedFirefoxProfile, self).encoded
+
+
+def get_firefox_profile(key, build_profile):
+    """ Return new Firefox profile cloned from template. Template is built on the first call for given key.
+
+    :param tuple key: identifies profile configuration (e.g. config section and files of extensions)
+    :param build_profile: function without arguments returning configured FirefoxProfile
+    :return: FirefoxProfile
+    """
+
+    with templates_lock:
+        template = profile_templates.get(key)
+        if template is None:
+            template = ProfileTemplate(build_profile())
+            profile_templates[key] = template
+
+    return template.clone()
+
+
+@atexit.register
+def remove_templates():
+    with templates_lock:
+        for template in profile_templates.values():
+            template.remove()
+        profile_templates.clear()
@@ -1,9 +1,82 @@
+import atexit
 import json
 import os
 import re
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 
+from shishito.runtime.session_pool import session_pool
 from shishito.runtime.shishito_support import ShishitoSupport
-from shishito.ui.selenium_support import SeleniumTest
+from shishito.ui.selenium_support import SeleniumTest, get_implicit_wait_tracker
+
+
+# webdrivers quit in background (setting "background_quit")
+background_executor = None
+background_futures = []
+background_lock = threading.Lock()
+
+
+def run_in_background(function, *args):
+    """ Run function on background thread. Exceptions are printed by wait_for_background_tasks. """
+
+    global background_executor
+
+    with background_lock:
+        if background_executor is None:
+            background_executor = ThreadPoolExecutor(max_workers=8)
+        background_futures.append(background_executor.submit(function, *args))
+
+
+@atexit.register
+def wait_for_background_tasks():
+    """ Wait until all background tasks (webdriver quits) finish. """
+
+    with background_lock:
+        futures = background_futures[:]
+        del background_futures[:]
+
+    for future in futures:
+        try:
+            future.result()
+        except Exception:
+            print('Background teardown failed:')
+            traceback.print_exc()
+
+
+def get_worker_share(count):
+    """ Return part of count belonging to current pytest-xdist worker, when count is split between all workers
+    of the combination (count itself without xdist).
+
+    :param int count: number to split
+    :return: int
+    """
+
+    workers = int(os.environ.get('PYTEST_XDIST_WORKER_COUNT') or 1)
+    if workers > 1:
+        worker_index = int(os.environ.get('PYTEST_XDIST_WORKER', 'gw0')[2:])
+        count = count // workers + (1 if worker_index < count % workers else 0)
+    return count
+
+
+def run_concurrently(function, items):
+    """ Call function for every item, on parallel threads if there are more items.
+    Waits for all calls, then re-raises the first exception.
+
+    :param function: function with one argument
+    :param list items: arguments for function calls
+    """
+
+    items = list(items)
+    if len(items) < 2:
+        for item in items:
+            function(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=len(items)) as executor:
+        futures = [executor.submit(function, item) for item in items]
+    for future in futures:
+        future.result()
 
 
 class ShishitoControlTest(object):
@@ -27,9 +100,12 @@ class ShishitoControlTest(object):
         config_section = self.shishito_support.get_opt('environment_configuration')
 
         # call browser from proper environment
-        driver = self.test_environment.call_browser(config_section)
+        driver = self.get_browser(config_section)
         self.drivers.append(driver)
 
+        # skip implicitly_wait commands which do not change the value
+        get_implicit_wait_tracker(driver)
+
         # load init url
         if not base_url:
             base_url = self.shishito_support.get_opt('base_url')
@@ -40,6 +116,88 @@ class ShishitoControlTest(object):
             self.test_init(driver)
         return driver
 
+    def is_session_reuse(self):
+        """ Return True if webdriver sessions are reused by test classes (setting "session_reuse"). """
+
+        return str(self.shishito_support.get_opt('session_reuse')).lower() == 'true'
+
+    def get_prefetch_count(self):
+        """ Return number of webdrivers started ahead on background threads (setting "browser_prefetch").
+        With pytest-xdist the number is split between workers of the combination. """
+
+        return get_worker_share(int(self.shishito_support.get_opt('browser_prefetch') or 0))
+
+    def get_session_key(self, config_section):
+        return session_pool.get_key(self.shishito_support.get_opt('test_environment'), config_section)
+
+    def prefetch_browsers(self, config_section=None):
+        """ Start webdrivers for given config section on background threads, so that next start_browser()
+        calls get already started browser.
+
+        :param str config_section: section in platform/environment.properties config (default "environment_configuration")
+        """
+
+        count = self.get_prefetch_count()
+        if not count:
+            return
+
+        config_section = config_section or self.shishito_support.get_opt('environment_configuration')
+        session_pool.prefetch(self.get_session_key(config_section), self.test_environment,
+                              lambda: self.test_environment.call_browser(config_section), count)
+
+    def get_browser(self, config_section):
+        """ Start webdriver for given config section, or take it from the session pool if sessions are reused.
+
+        :param str config_section: section in platform/environment.properties config
+        :return: webdriver
+        """
+
+        session_reuse = self.is_session_reuse()
+        if not session_reuse and not self.get_prefetch_count():
+            return self.test_environment.call_browser(config_section)
+
+        session_pool.configure(self.shishito_support.get_opt('session_max_age'),
+                               self.shishito_support.get_opt('session_max_uses'), session_reuse)
+        driver = session_pool.get(self.get_session_key(config_section), self.test_environment,
+                                  lambda: self.test_environment.call_browser(config_section))
+
+        # keep browsers for the next test classes starting
+        self.prefetch_browsers(config_section)
+        return driver
+
+    def is_background_quit(self):
+        """ Return True if webdrivers are quit in background (setting "background_quit"). """
+
+        return str(self.shishito_support.get_opt('background_quit')).lower() == 'true'
+
+    def run_teardown(self, function, drivers):
+        """ Run teardown function for all drivers concurrently, in background if "background_quit" is set.
+
+        :param function: function with driver argument
+        :param list drivers: drivers to tear down
+        """
+
+        if self.is_background_quit():
+            for driver in drivers:
+                run_in_background(function, driver)
+        else:
+            run_concurrently(function, drivers)
+
+    def quit_browser(self, driver):
+        """ Quit webdriver, or return it to the session pool if it comes from there.
+
+        :param WebDriver driver: driver to quit
+        """
+
+        if session_pool.put(driver):
+            return
+
+        try:
+            driver.quit()
+        finally:
+            # free session slot even if the session is already dead
+            self.test_environment.release_browser(driver)
+
     def start_test(self, reload_page=None):
         """ To be executed before every test-case (test function).
 
@@ -49,8 +207,8 @@ class ShishitoControlTest(object):
     def stop_browser(self):
         """ Webdriver termination function. """
 
-        for driver in self.drivers:
-            driver.quit()   # Cleanup the driver info
+        self.run_teardown(self.quit_browser, self.drivers[:])
+        # Cleanup the driver info
         del self.drivers[:]
 
     def stop_test(self, test_info, debug_events=None):
@@ -64,26 +222,35 @@ class ShishitoControlTest(object):
             # save screenshot in case test fails
             test_name = re.sub('[^A-Za-z0-9_.]+', '_', test_info.test_name)
 
-            # Capture screenshot and debug info from driver(s)
+            # create folders before capturing from drivers in parallel
+            screenshot_folder = os.path.join(self.shishito_support.project_root, 'screenshots')
+            debugevent_folder = os.path.join(self.shishito_support.project_root, 'debug_events')
+            os.makedirs(screenshot_folder, exist_ok=True)
+            if debug_events is not None:
+                os.makedirs(debugevent_folder, exist_ok=True)
+
+            file_names = []
             for driver in self.drivers:
                 if(self.shishito_support.test_platform == 'mobile'):
                     browser_name = 'appium'
                 else:
                     browser_name = driver.name
-                file_name = browser_name + '_' + test_name
-                ts = SeleniumTest(driver)
-                ts.save_screenshot(name=file_name)
-
-                #Save debug info to file
-                if debug_events is not None:
-                    debugevent_folder = os.path.join(self.shishito_support.project_root, 'debug_events')
-
-                    if not os.path.exists(debugevent_folder):
-                        os.makedirs(debugevent_folder)
+                file_names.append(browser_name + '_' + test_name)
 
+            #Save debug info to file
+            if debug_events is not None:
+                for file_name in set(file_names):
                     with open(os.path.join(debugevent_folder, file_name + '.json'), 'w') as logfile:
                             json.dump(debug_events, logfile)
 
+            def capture(driver_file_name):
+                driver, file_name = driver_file_name
+                ts = SeleniumTest(driver)
+                ts.save_screenshot(name=file_name)
+
+            # Capture screenshots from all drivers in parallel (screenshot paths are reserved by the registry)
+            run_concurrently(capture, zip(self.drivers, file_names))
+
     def test_init(self, driver, url=None):
         """ Executed only once after browser starts.
          Suitable for general pre-test logic that do not need to run before every individual test-case.
@@ -5,29 +5,114 @@
 
 import os
 import sys
+
 import pytest
 
+from shishito.runtime.collection_cache import CollectionCache
+from shishito.runtime.failure_budget import FailureBudget
+from shishito.runtime.scheduling import DurationHistory, get_junit_test_id, get_result_name, get_result_test_id, \
+    order_failed_first, order_longest_first, parse_shard, partition_longest_first
+from shishito.runtime.shishito_support import ShishitoSupport
+from shishito.runtime.worker_pool import WorkerDied, WorkerError, WorkerPool
+
+# pytest exit codes (see pytest.ExitCode)
+EXIT_OK = 0
+EXIT_INTERRUPTED = 2
+EXIT_INTERNALERROR = 3
+EXIT_NOTESTSCOLLECTED = 5
+
 class CollectionPlugin:
     # collect test data from pytest
 
     def __init__(self):
         self.collected = []
+        self.test_ids = []
+        self.rootdir = None
 
     def pytest_collection_modifyitems(self, items):
         for item in items:
             self.collected.append((item.cls, item.name))
 
+    def pytest_collection_finish(self, session):
+        # node ids of tests that were selected (after -k / -m deselection)
+        self.rootdir = str(getattr(session.config, 'rootpath', None) or session.config.rootdir)
+        self.test_ids = [item.nodeid for item in session.items]
+
+
+def combine_exit_codes(exit_codes):
+    """ Combine PyTest exit codes of all combinations into single exit code for the whole run.
+    Any failing combination makes the run fail; "no tests collected" is reported only if nothing else failed.
+
+    :param list exit_codes: exit codes returned by pytest.main() for each combination
+     (None for combination whose worker process died)
+    :return: int with combined exit code
+    """
+
+    exit_codes = [EXIT_INTERNALERROR if exit_code is None else exit_code for exit_code in exit_codes]
+    failures = [int(exit_code) for exit_code in exit_codes if int(exit_code) != EXIT_OK]
+    if not failures:
+        return EXIT_OK
+
+    test_failures = [exit_code for exit_code in failures if exit_code != EXIT_NOTESTSCOLLECTED]
+    return max(test_failures) if test_failures else EXIT_NOTESTSCOLLECTED
+
+
+def run_collection(pytest_arguments):
+    """ Collect tests in worker process.
+
+    :param list pytest_arguments: arguments for pytest.main()
+    :return: tuple (result of pytest.main() function, pytest rootdir, list with node ids of collected tests)
+    """
+
+    collect_plugin = CollectionPlugin()
+    exit_code = pytest.main(pytest_arguments, plugins=[collect_plugin])
+    return int(exit_code), collect_plugin.rootdir, collect_plugin.test_ids
+
+
+def run_combination(cmd_args, project_root, test_timestamp, config_section, collection=None, test_ids=None):
+    """ Run PyTest for single browser/device combination. Used as entry point of combination worker process,
+    so that every combination gets its own isolated ShishitoSupport, environment and pytest instance.
+
+    :param dict cmd_args: command line arguments of the runner
+    :param str project_root: test project root
+    :param str test_timestamp: timestamp of the test run (name of the result folder)
+    :param str config_section: section in platform/environment.properties config
+    :param dict collection: tests collected before the run (see ShishitoExecution.get_collection)
+    :param list test_ids: collected tests to run for the combination (see ShishitoExecution.get_test_ids)
+    :return: result of pytest.main() function
+    """
+
+    shishito_support = ShishitoSupport(cmd_args=cmd_args, project_root=project_root)
+    executor_class = shishito_support.get_module('platform_execution')
+    executor = executor_class(shishito_support, test_timestamp)
+    executor.collection = collection
+    return int(executor.trigger_pytest(config_section, test_ids))
+
 class ShishitoExecution(object):
     """ Base class for platform ControlExecution objects. """
 
     def __init__(self, shishito_support, test_timestamp):
         self.shishito_support = shishito_support
+        self.test_timestamp = test_timestamp
 
         environment_class = self.shishito_support.get_module('test_environment')
         self.environment = environment_class(shishito_support)
 
         self.result_folder = os.path.join(self.shishito_support.project_root, 'results', test_timestamp)
 
+        # tests collected once for all combinations (None = let pytest collect test directory)
+        self.collection = None
+
+        # node ids of all collected tests, including tests of other shards
+        self.collected_test_ids = []
+
+        # tests failed in previous run {config section: [(classname, name)]}, used by last_failed and failed_first
+        # modes (see Reporter.get_failed_tests)
+        self.failed_tests = None
+
+        # worker processes running pytest (see run_tests)
+        self.worker_pool = None
+
     def get_test_result_prefix(self, config_section):
         """ Create string prefix for test results.
 
@@ -40,17 +125,94 @@ class ShishitoExecution(object):
     def run_tests(self):
         """ Trigger PyTest runner.
         Run PyTest for each browser/device combination, taken from .properties file for proper
-        platform and environment.
+        platform and environment. Every pytest run (collection, combinations) runs in its own worker process.
         """
 
-        test_status = 0
+        parallel_combinations = int(self.shishito_support.get_opt('parallel_combinations', default=1))
 
-        for config_section in self.shishito_support.env_config.sections():
+        self.worker_pool = self.get_worker_pool(max(parallel_combinations, 1))
+        try:
+            return self.run_combinations(parallel_combinations)
+        finally:
+            self.worker_pool.close()
 
-            print('Running combination: ' + config_section)
-            test_status = self.trigger_pytest(config_section)
+    def get_worker_pool(self, processes):
+        """ Create pool of worker processes with preloaded test modules.
+        Project modules to preload (e.g. page objects) can be set in 'preload_modules' config option.
+
+        :param int processes: max number of worker processes running at the same time
+        :return: WorkerPool object
+        """
+
+        preload_modules = ['shishito.runtime.platform.%s.control_test' % self.shishito_support.test_platform]
+        preload_modules.extend((self.shishito_support.get_opt('preload_modules') or '').split())
+
+        return WorkerPool(
+            processes=processes,
+            preload_modules=preload_modules,
+            start_method=self.shishito_support.get_opt('worker_start_method'),
+            project_root=self.shishito_support.project_root
+        )
+
+    def run_combinations(self, parallel_combinations):
+        """ Collect tests and run them for each browser/device combination.
+
+        :param int parallel_combinations: max number of combinations running at the same time
+        :return: combined exit code of all combinations
+        """
+
+        config_sections = self.shishito_support.env_config.sections()
+
+        shard = self.shishito_support.get_opt('shard')
+        if self.is_collection_needed():
+            self.collection = self.get_collection()
+            self.collected_test_ids = self.collection['test_ids'] if self.collection else []
+
+        if shard:
+            self.collection = self.select_shard(self.collection, shard)
+            if not self.collection['test_ids']:
+                print('No tests to run in shard %s' % shard)
+                return EXIT_OK
+
+        if self.failed_tests is not None and not self.collection:
+            raise ValueError('Tests could not be collected, unable to select previously failed tests.')
 
-        return test_status
+        combinations = [(config_section, self.get_test_ids(config_section)) if self.collection else (config_section, None)
+                        for config_section in config_sections]
+
+        if self.shishito_support.get_opt('last_failed'):
+            combinations = [(config_section, test_ids) for config_section, test_ids in combinations if test_ids]
+            if not combinations:
+                print('No failed tests to rerun')
+                return EXIT_OK
+
+        results = []
+        for config_section, test_ids in combinations:
+            print('Running combination: ' + config_section)
+            results.append(self.worker_pool.submit(
+                run_combination,
+                self.shishito_support.args_config,
+                self.shishito_support.project_root,
+                self.test_timestamp,
+                config_section,
+                self.collection,
+                test_ids
+            ))
+
+        exit_codes = []
+        for (config_section, test_ids), result in zip(combinations, results):
+            try:
+                exit_code = result.get()
+            except WorkerDied as e:
+                print('Combination %s did not finish: %s' % (config_section, e))
+                exit_code = None
+            except WorkerError as e:
+                print('Combination %s failed to run:\n%s' % (config_section, e))
+                exit_code = EXIT_INTERNALERROR
+            print('Combination %s finished with exit code %s' % (config_section, exit_code))
+            exit_codes.append(exit_code)
+
+        return combine_exit_codes(exit_codes)
 
     def collect_tests(self):
         # collect tests discoverable by pytest
@@ -69,18 +231,237 @@ class ShishitoExecution(object):
 
         return collect_plugin.collected
 
-    def trigger_pytest(self, config_section):
+    def get_collection(self):
+        """ Collect node ids of selected tests, used to select and order tests of each combination (shards,
+        last failed tests, duration scheduling). Collection is cached and reused until test files change.
+        Combinations still import and collect modules of the tests they run.
+
+        :return: dict with pytest 'rootdir' (relative to project root) and 'test_ids' or None if collection failed
+        """
+
+        test_directory = self.shishito_support.get_opt('test_directory')
+        project_root = self.shishito_support.project_root
+
+        collection_cache = CollectionCache(project_root, test_directory)
+        collection = collection_cache.get(self.get_test_selection_arguments())
+        if collection is not None:
+            print('Using cached collection of %s tests' % len(collection['test_ids']))
+            return collection
+
+        pytest_arguments = [
+            os.path.join(project_root, test_directory),
+        ]
+
+        pytest_arguments.extend(['--collect-only'])
+        pytest_arguments.extend(['-p', 'no:terminal'])
+        pytest_arguments.extend(self.get_plugin_arguments())
+        pytest_arguments.extend(self.get_test_selection_arguments())
+
+        if self.worker_pool:
+            exit_code, rootdir, test_ids = self.worker_pool.run(run_collection, pytest_arguments)
+        else:
+            exit_code, rootdir, test_ids = run_collection(pytest_arguments)
+
+        # let pytest report collection errors in test results of every combination
+        if exit_code != EXIT_OK or not test_ids:
+            print('Test collection finished with exit code %s, tests will be collected for each combination' % exit_code)
+            return None
+
+        collection = {
+            'rootdir': os.path.relpath(rootdir, project_root),
+            'test_ids': test_ids,
+        }
+        collection_cache.store(collection)
+        return collection
+
+    def select_shard(self, collection, shard):
+        """ Keep only tests belonging to given shard. Tests are split between shards according to their
+        duration in previous runs; tests of one class always belong to the same shard.
+
+        :param dict collection: collected tests (see get_collection)
+        :param str shard: shard in format "INDEX/COUNT", INDEX starts from 0
+        :return: dict with collected tests of the shard
+        :raises ValueError: if tests could not be collected
+        """
+
+        index, count = parse_shard(shard)
+        if not collection:
+            raise ValueError('Tests could not be collected, unable to split them into shards.')
+
+        durations = DurationHistory(self.shishito_support.project_root).get_durations()
+        test_ids = partition_longest_first(collection['test_ids'], durations, count)[index]
+        print('Running shard %s: %s of %s tests' % (shard, len(test_ids), len(collection['test_ids'])))
+
+        return dict(collection, test_ids=test_ids)
+
+    def get_plugin_arguments(self):
+        """ Return pytest arguments loading plugins needed for test execution.
+
+        :return: list with pytest arguments
+        """
+
+        if sys.version_info.major > 2:
+            return ['-p', 'pytest_imports']   # import parser addoption to support extra options
+        return []
+
+    def get_test_selection_arguments(self):
+        """ Return pytest arguments selecting tests to run (smoke tests, PyTest string expression).
+
+        :return: list with pytest arguments
+        """
+
+        pytest_arguments = []
+
+        # set pytest smoke test argument
+        smoke = self.shishito_support.get_opt('smoke')
+        if smoke:
+            pytest_arguments.extend(['-m', 'smoke'])
+
+        # run only specific tests
+        test_stringexpr = self.shishito_support.get_opt('test')
+        if test_stringexpr:
+            pytest_arguments.extend(['-k', test_stringexpr])
+
+        return pytest_arguments
+
+    def is_collection_needed(self):
+        """ Return True if node ids of tests have to be collected before combinations are run (shards, last failed
+        tests, duration scheduling or 'collection_cache' option). Otherwise every combination collects the test
+        directory itself and no extra collection is done.
+        """
+
+        get_opt = self.shishito_support.get_opt
+        return bool(get_opt('shard')) or self.failed_tests is not None or \
+            get_opt('duration_scheduling', default='false').lower() == 'true' or \
+            get_opt('collection_cache', default='false').lower() == 'true'
+
+    def is_duration_scheduling(self):
+        """ Return True if tests should be scheduled according to their duration in previous runs. """
+
+        return bool(self.collection) and \
+            self.shishito_support.get_opt('duration_scheduling', default='false').lower() == 'true'
+
+    def is_duration_history_used(self):
+        """ Return True if durations of tests are needed by next runs (duration scheduling or shards). """
+
+        return self.shishito_support.get_opt('duration_scheduling', default='false').lower() == 'true' or \
+            bool(self.shishito_support.get_opt('shard'))
+
+    def update_duration_history(self, xunit_test_cases):
+        """ Remember durations of collected tests which were run, for scheduling of next runs.
+
+        :param list xunit_test_cases: test cases for each report file (see Reporter.get_xunit_test_cases)
+        """
+
+        if not self.collection:
+            return
+
+        result_prefixes = dict((config_section, self.get_test_result_prefix(config_section))
+                               for config_section in self.shishito_support.env_config.sections())
+        DurationHistory(self.shishito_support.project_root).update(
+            xunit_test_cases, self.collection['test_ids'], result_prefixes)
+
+    def get_failed_test_ids(self, config_section):
+        """ Return collected tests that failed in previous run of given combination. Failures are matched
+        to tests by full node id, failures which are not tests (e.g. collection errors) do not match any test.
+
+        :param str config_section: section in platform/environment.properties config
+        :return: tuple (list with pytest node ids of failed tests, number of failures not matching any collected test)
+        """
+
+        prefix = self.get_test_result_prefix(config_section)
+        junit_test_ids = dict((get_junit_test_id(test_id), test_id) for test_id in self.collected_test_ids)
+
+        failed_test_ids = []
+        unmatched_count = 0
+        for classname, name in (self.failed_tests or {}).get(config_section, []):
+            test_id = junit_test_ids.get(get_result_test_id(classname, name, prefix))
+            if test_id is None:
+                unmatched_count += 1
+            elif test_id not in failed_test_ids:
+                failed_test_ids.append(test_id)
+        return failed_test_ids, unmatched_count
+
+    def get_test_ids(self, config_section):
+        """ Return collected tests for given combination, in order in which they should be executed.
+        In last_failed mode only tests that failed in previous run of the combination are returned
+        (all tests if some failures do not match any collected test), in failed_first mode they are
+        moved to the beginning.
+
+        :param str config_section: section in platform/environment.properties config
+        :return: list with pytest node ids
+        """
+
+        test_ids = self.collection['test_ids']
+        failed_test_ids, unmatched_count = self.get_failed_test_ids(config_section)
+
+        if self.shishito_support.get_opt('last_failed'):
+            if unmatched_count:
+                print('%s failures of combination %s do not match any collected test (e.g. collection errors), '
+                      'rerunning all tests' % (unmatched_count, config_section))
+            else:
+                test_ids = [test_id for test_id in test_ids if test_id in failed_test_ids]
+
+        if self.is_duration_scheduling():
+            durations = DurationHistory(self.shishito_support.project_root).get_durations(config_section)
+            test_ids = order_longest_first(test_ids, durations)
+
+        if self.shishito_support.get_opt('failed_first'):
+            test_ids = order_failed_first(test_ids, failed_test_ids)
+
+        return test_ids
+
+    def get_test_paths(self, test_ids=None):
+        """ Return pytest arguments with tests to run.
+
+        :param list test_ids: collected tests to run (see get_test_ids), None to run whole test directory
+        :return: list with pytest arguments
+        """
+
+        project_root = self.shishito_support.project_root
+
+        if test_ids is not None:
+            rootdir = os.path.normpath(os.path.join(project_root, self.collection['rootdir']))
+            pytest_arguments = [os.path.join(rootdir, test_id) for test_id in test_ids]
+            pytest_arguments.append('--rootdir=' + rootdir)
+            return pytest_arguments
+
+        test_directory = self.shishito_support.get_opt('test_directory')
+        if not test_directory:
+            raise ValueError('Not test directory was specified.')
+
+        return [os.path.join(project_root, test_directory)]
+
+    def get_failure_budget(self):
+        """ Return failure budget shared by all combinations of the test run (set by 'failure_budget' option).
+
+        :return: FailureBudget object or None
+        """
+
+        budget = self.shishito_support.get_opt('failure_budget')
+        if not budget:
+            return None
+        return FailureBudget(os.path.join(self.result_folder, 'failure_budget.json'), budget)
+
+    def trigger_pytest(self, config_section, test_ids=None):
         """ Run PyTest runner on specific browser/device configuration. Function creates arguments for pytest.
         Function executes pytest.main() with created arguments.
 
         :param str config_section: section in platform/environment.properties config
+        :param list test_ids: collected tests to run (see get_test_ids), None to run whole test directory
         :return: result of pytest.main() function
         """
 
+        failure_budget = self.get_failure_budget()
+        if failure_budget and failure_budget.is_spent():
+            print('Failure budget of the test run is spent, skipping combination: ' + config_section)
+            return EXIT_INTERRUPTED
+
         test_result_prefix = self.get_test_result_prefix(config_section)
 
-        junit_xml_path = os.path.join(self.result_folder, config_section + '.xml')
-        html_path = os.path.join(self.result_folder, config_section + '.html')
+        result_name = get_result_name(config_section, self.shishito_support.get_opt('shard'))
+        junit_xml_path = os.path.join(self.result_folder, result_name + '.xml')
+        html_path = os.path.join(self.result_folder, result_name + '.html')
 
         # prepare pytest arguments into execution list
         pytest_arguments_dict = {
@@ -98,22 +479,18 @@ class ShishitoExecution(object):
         if extra_pytest_arguments:
             pytest_arguments_dict.update(extra_pytest_arguments)
 
-        test_directory = self.shishito_support.get_opt('test_directory')
-        if not test_directory:
-            raise ValueError('Not test directory was specified.')
-
-        pytest_arguments = [
-            os.path.join(self.shishito_support.project_root, test_directory),
-        ]
+        pytest_arguments = self.get_test_paths(test_ids)
 
         pytest_arguments.extend(pytest_arguments_dict.values())
-        if sys.version_info.major > 2:
-            pytest_arguments.extend(['-p', 'pytest_imports'])   # import parser addoption to support extra options
+        pytest_arguments.extend(self.get_plugin_arguments())
 
         # set pytest parallel execution argument
         parallel_tests = int(self.shishito_support.get_opt('parallel_tests'))
         if parallel_tests > 1:
             pytest_arguments.extend(['-n', str(parallel_tests)])
+            if self.is_duration_scheduling():
+                # workers take whole test classes in the (longest first) order of test ids
+                pytest_arguments.extend(['--dist', 'loadscope'])
 
         # set pytest maxfail argument
         maxfail = self.shishito_support.get_opt('maxfail')
@@ -121,15 +498,15 @@ class ShishitoExecution(object):
         if maxfail:
             pytest_arguments.extend(['--maxfail={}'.format(maxfail)])
 
-        # set pytest smoke test argument
-        smoke = self.shishito_support.get_opt('smoke')
-        if smoke:
-            pytest_arguments.extend(['-m', 'smoke'])
+        # set run-wide failure budget shared by all combinations
+        if failure_budget:
+            pytest_arguments.extend(['-p', 'shishito.runtime.failure_budget',
+                                     '--failure_budget={}'.format(failure_budget.budget),
+                                     '--failure_budget_file={}'.format(failure_budget.state.path)])
 
-        # run only specific tests
-        test_stringexpr = self.shishito_support.get_opt('test')
-        if test_stringexpr:
-            pytest_arguments.extend(['-k', test_stringexpr])
+        # select tests (already applied to collected tests)
+        if test_ids is None:
+            pytest_arguments.extend(self.get_test_selection_arguments())
 
         # verbose diffs
         pytest_arguments.extend(['-vv'])
@@ -18,22 +18,23 @@ class ControlTest(ShishitoControlTest):
 
         :param bool delete_cookies: delete cookies from webdriver
         """
-        if not driver:
-            # Close all drivers
-            for d in self.drivers:
+        def stop(d):
+            try:
                 if delete_cookies:
                     d.delete_all_cookies()
+            finally:
+                self.quit_browser(d)
 
-                d.quit()
+        if not driver:
+            # Close all drivers (concurrently)
+            self.run_teardown(stop, self.drivers[:])
 
             # Cleanup the driver info
             del self.drivers[:]
 
         else:
             # Close just the specific driver
-            if delete_cookies:
-                driver.delete_all_cookies()
-            driver.quit()
+            self.run_teardown(stop, [driver])
 
             self.drivers.remove(driver)
 
@@ -0,0 +1,250 @@
+"""
+@summary: Duration based test scheduling
+"""
+import json
+import os
+import re
+from collections import OrderedDict
+
+from shishito.runtime.collection_cache import CACHE_FOLDER
+
+# weight of the latest duration in moving average of test duration
+DURATION_WEIGHT = 0.5
+
+# separates config section and shard in name of result files ('Chrome.shard0of4.xml')
+SHARD_SEPARATOR = '.shard'
+
+
+class DurationHistory(object):
+    """ History of test durations per combination, built from junit results of previous runs.
+    Tests are identified by their pytest node ids.
+
+    :param str project_root: test project root
+    """
+
+    def __init__(self, project_root):
+        self.history_file = os.path.join(project_root, CACHE_FOLDER, 'durations.json')
+
+    def load(self):
+        """ Load duration history.
+
+        :return: dict {test id: {config section: duration}}
+        """
+
+        try:
+            with open(self.history_file) as history_file:
+                history = json.load(history_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+        # drop entries of older versions, which identified tests by name only
+        return {test_id: durations for test_id, durations in history.items() if '::' in test_id}
+
+    def update(self, xunit_test_cases, test_ids, result_prefixes=None):
+        """ Update history with durations of finished test run.
+
+        :param list xunit_test_cases: test cases for each report file (see Reporter.get_xunit_test_cases)
+        :param list test_ids: node ids of tests which were run (results of other tests are ignored)
+        :param dict result_prefixes: junit prefix of each config section (see get_test_result_prefix)
+        """
+
+        history = self.load()
+        result_prefixes = result_prefixes or {}
+        junit_test_ids = dict((get_junit_test_id(test_id), test_id) for test_id in test_ids)
+
+        for run in xunit_test_cases:
+            config_section = get_result_config_section(os.path.splitext(run['name'])[0])
+            prefix = result_prefixes.get(config_section)
+            for case in run['cases']:
+                test_id = junit_test_ids.get(get_result_test_id(case['classname'], case['name'], prefix))
+                if case['result'] == 'skipped' or test_id is None:
+                    continue
+                durations = history.setdefault(test_id, {})
+                previous = durations.get(config_section)
+                if previous is None:
+                    durations[config_section] = case['duration']
+                else:
+                    durations[config_section] = (1 - DURATION_WEIGHT) * previous + DURATION_WEIGHT * case['duration']
+
+        history_folder = os.path.dirname(self.history_file)
+        if not os.path.exists(history_folder):
+            os.makedirs(history_folder)
+
+        with open(self.history_file, 'w') as history_file:
+            json.dump(history, history_file, indent=1, sort_keys=True)
+
+    def get_durations(self, config_section=None):
+        """ Return expected duration of each test. If the test did not run for given combination yet,
+        average duration from other combinations is used.
+
+        :param str config_section: section in platform/environment.properties config
+        :return: dict {test id: duration}
+        """
+
+        durations = {}
+        for test_id, section_durations in self.load().items():
+            if config_section in section_durations:
+                durations[test_id] = section_durations[config_section]
+            elif section_durations:
+                durations[test_id] = sum(section_durations.values()) / len(section_durations)
+        return durations
+
+
+def get_junit_test_id(test_id):
+    """ Return test id in form of junit results, without junit prefix
+    ('tests/test_file.py::TestClass::test_name' -> 'tests.test_file.TestClass::test_name').
+    Same conversion as pytest junitxml uses for classname and name of test cases. """
+
+    path, bracket, params = test_id.partition('[')
+    names = path.split('::')
+    names[0] = re.sub(r'\.py$', '', names[0].replace('/', '.'))
+    names[-1] += bracket + params
+    return '.'.join(names[:-1]) + '::' + names[-1]
+
+
+def get_result_test_id(classname, name, prefix=None):
+    """ Return test id of junit test case (see get_junit_test_id).
+
+    :param str classname: classname of test case
+    :param str name: name of test case
+    :param str prefix: junit prefix of the results (see get_test_result_prefix)
+    :return: str
+    """
+
+    if prefix and classname.startswith(prefix + '.'):
+        classname = classname[len(prefix) + 1:]
+    return classname + '::' + name
+
+
+def get_test_scope(test_id):
+    """ Return scope (test class or module) of the test, tests from the same scope share browser session.
+    Same scope definition as pytest-xdist --dist loadscope uses. """
+    return test_id.rsplit('::', 1)[0]
+
+
+def group_by_scope(test_ids):
+    """ Group test node ids by test scope, keeping collection order.
+
+    :param list test_ids: pytest node ids
+    :return: OrderedDict {scope: [test ids]}
+    """
+
+    groups = OrderedDict()
+    for test_id in test_ids:
+        groups.setdefault(get_test_scope(test_id), []).append(test_id)
+    return groups
+
+
+def get_scope_durations(groups, durations):
+    """ Compute expected duration of each test scope. Tests without history are expected
+    to take average duration of known tests.
+
+    :param OrderedDict groups: test scopes (see group_by_scope)
+    :param dict durations: test durations (see DurationHistory.get_durations)
+    :return: dict {scope: duration}
+    """
+
+    default_duration = sum(durations.values()) / len(durations) if durations else 1.0
+    return {
+        scope: sum(durations.get(test_id, default_duration) for test_id in scope_tests)
+        for scope, scope_tests in groups.items()
+    }
+
+
+def order_longest_first(test_ids, durations):
+    """ Order tests so that the longest test scopes (classes, modules) run first.
+    Tests of one scope are kept together and in collection order. When workers pick the next scope
+    as soon as they are free (pytest-xdist --dist loadscope), the slowest tests do not end up
+    at the tail of the run and workers finish at roughly the same time.
+
+    :param list test_ids: pytest node ids
+    :param dict durations: test durations (see DurationHistory.get_durations)
+    :return: list with ordered test ids
+    """
+
+    groups = group_by_scope(test_ids)
+    scope_durations = get_scope_durations(groups, durations)
+
+    ordered_scopes = sorted(groups, key=lambda scope: -scope_durations[scope])  # sort is stable
+    return [test_id for scope in ordered_scopes for test_id in groups[scope]]
+
+
+def order_failed_first(test_ids, failed_tests):
+    """ Order tests so that test scopes (classes, modules) containing previously failed tests run first.
+    Tests of one scope are kept together and in original order.
+
+    :param list test_ids: pytest node ids
+    :param list failed_tests: node ids of tests that failed in previous run
+    :return: list with ordered test ids
+    """
+
+    failed_tests = set(failed_tests)
+    groups = group_by_scope(test_ids)
+
+    failed_scopes = [scope for scope, scope_tests in groups.items()
+                     if any(test_id in failed_tests for test_id in scope_tests)]
+    other_scopes = [scope for scope in groups if scope not in failed_scopes]
+    return [test_id for scope in failed_scopes + other_scopes for test_id in groups[scope]]
+
+
+def partition_longest_first(test_ids, durations, count):
+    """ Split tests into given number of parts with similar total duration (longest processing time first).
+    Test scopes (classes, modules) are never split, so a browser session of test class is started only
+    in one part. The result depends only on test ids and durations, so every CI node computes the same split.
+
+    :param list test_ids: pytest node ids
+    :param dict durations: test durations (see DurationHistory.get_durations)
+    :param int count: number of parts
+    :return: list of parts (lists with test ids in collection order)
+    """
+
+    groups = group_by_scope(test_ids)
+    scope_durations = get_scope_durations(groups, durations)
+
+    loads = [0.0] * count
+    part_scopes = [set() for _ in range(count)]
+    for scope in sorted(groups, key=lambda scope: (-scope_durations[scope], scope)):
+        part = loads.index(min(loads))
+        loads[part] += scope_durations[scope]
+        part_scopes[part].add(scope)
+
+    return [[test_id for test_id in test_ids if get_test_scope(test_id) in scopes] for scopes in part_scopes]
+
+
+def parse_shard(shard):
+    """ Parse shard specification.
+
+    :param str shard: shard in format "INDEX/COUNT", INDEX starts from 0
+    :return: tuple (index, count)
+    :raises ValueError: if shard specification is invalid
+    """
+
+    try:
+        index, count = [int(value) for value in shard.split('/')]
+    except (AttributeError, ValueError):
+        raise ValueError('Invalid shard "{0}", expected format is INDEX/COUNT (e.g. 0/4).'.format(shard))
+
+    if count < 1 or not 0 <= index < count:
+        raise ValueError('Invalid shard "{0}", INDEX must be between 0 and COUNT - 1.'.format(shard))
+
+    return index, count
+
+
+def get_result_name(config_section, shard=None):
+    """ Return name of result files (without extension) for given combination and shard.
+
+    :param str config_section: section in platform/environment.properties config
+    :param str shard: shard in format "INDEX/COUNT" or None
+    :return: str with result name
+    """
+
+    if not shard:
+        return config_section
+
+    index, count = parse_shard(shard)
+    return '{0}{1}{2}of{3}'.format(config_section, SHARD_SEPARATOR, index, count)
+
+
+def get_result_config_section(result_name):
+    """ Return config section from name of result files (see get_result_name). """
+    return result_name.split(SHARD_SEPARATOR)[0]
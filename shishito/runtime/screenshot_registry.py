@@ -0,0 +1,197 @@
+"""
+@summary: Index of screenshots saved by tests. Screenshots are recorded in manifest (manifest.jsonl in screenshots
+folder, one JSON record per line), so numbering new screenshots and finding screenshots of a test do not need
+to scan the folder. Every record holds the combination (html prefix) of the pytest run which took the screenshot,
+so combinations running in parallel do not get screenshots of each other.
+"""
+import json
+import os
+import re
+import threading
+import time
+
+from shishito.runtime.shared_state import FileLock
+
+MANIFEST_FILE = 'manifest.jsonl'
+
+# html prefix of the pytest run (set by shishito conftest), identifies combination which took the screenshot
+COMBINATION_ENV = 'SHISHITO_COMBINATION'
+
+
+def get_current_test_name():
+    """ Return name of currently running test function (from PYTEST_CURRENT_TEST), None outside of test. """
+
+    current_test = os.environ.get('PYTEST_CURRENT_TEST')
+    if not current_test:
+        return None
+    return current_test.split('::')[-1].split(' ')[0]
+
+
+def get_current_combination():
+    """ Return combination (html prefix) of current pytest run, None if it is not set. """
+
+    return os.environ.get(COMBINATION_ENV) or None
+
+
+def normalize_test_name(test_name):
+    """ Return test name in form used in screenshot names (see ShishitoControlTest.stop_test). """
+
+    return re.sub('[^A-Za-z0-9_.]+', '_', test_name)
+
+
+class ScreenshotRegistry(object):
+    """ Screenshots of one folder indexed by screenshot name and by test. Manifest is shared by all test
+    processes (records are appended), every registry reads only records added since its last refresh.
+    New screenshot paths are reserved under file lock, so parallel processes and threads never get the same path.
+
+    :param str folder: screenshots folder
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.manifest_path = os.path.join(folder, MANIFEST_FILE)
+        self.lock = threading.RLock()
+        self.file_lock = FileLock(self.manifest_path + '.lock')
+        self.by_name = {}
+        self.by_test = {}
+        self.offset = 0
+
+    def refresh(self):
+        """ Read records appended to manifest since last refresh. """
+
+        with self.lock:
+            try:
+                size = os.path.getsize(self.manifest_path)
+            except OSError:
+                size = 0
+
+            if size < self.offset:
+                # manifest was removed with the folder
+                self.by_name.clear()
+                self.by_test.clear()
+                self.offset = 0
+
+            if size == self.offset:
+                return
+
+            with open(self.manifest_path, 'rb') as manifest:
+                manifest.seek(self.offset)
+                for line in manifest:
+                    if not line.endswith(b'\n'):
+                        break  # record being written
+                    self.offset += len(line)
+                    self.add(json.loads(line.decode('utf-8')))
+
+    def prune(self):
+        """ Remove records of screenshots which no longer exist from manifest (e.g. before new test run). """
+
+        with self.lock:
+            try:
+                with open(self.manifest_path, 'rb') as manifest:
+                    lines = [line for line in manifest if line.endswith(b'\n')]
+            except OSError:
+                return
+
+            kept = [line for line in lines
+                    if os.path.exists(os.path.join(self.folder, json.loads(line.decode('utf-8'))['file']))]
+            with open(self.manifest_path + '.tmp', 'wb') as manifest:
+                manifest.writelines(kept)
+            os.replace(self.manifest_path + '.tmp', self.manifest_path)
+
+            self.by_name.clear()
+            self.by_test.clear()
+            self.offset = 0
+
+    def add(self, record):
+        self.by_name.setdefault(record['name'], []).append(record)
+        if record.get('test'):
+            self.by_test.setdefault(record['test'], []).append(record)
+
+    def reserve(self, name, extension='png', test_name=None, combination=None):
+        """ Return path for next screenshot of given name ('<name>_<number>.<extension>') and record it
+        in manifest, before the screenshot is written.
+
+        :param str name: screenshot name
+        :param str extension: file extension (image format)
+        :param str test_name: test the screenshot belongs to (default currently running test)
+        :param str combination: combination (html prefix) of the test run (default current combination)
+        :return: str
+        """
+
+        with self.lock, self.file_lock:
+            self.refresh()
+            number = len(self.by_name.get(name, [])) + 1
+            path = os.path.join(self.folder, '{}_{}.{}'.format(name, number, extension))
+
+            # screenshots saved before the manifest existed
+            while os.path.exists(path):
+                number += 1
+                path = os.path.join(self.folder, '{}_{}.{}'.format(name, number, extension))
+
+            self.register(path, name, test_name, combination)
+            return path
+
+    def register(self, path, name, test_name=None, combination=None):
+        """ Record saved screenshot in manifest (e.g. screenshot identical to previously saved one).
+
+        :param str path: path of saved screenshot
+        :param str name: screenshot name (see reserve)
+        :param str test_name: test the screenshot belongs to (default currently running test)
+        :param str combination: combination (html prefix) of the test run (default current combination)
+        """
+
+        test_name = test_name or get_current_test_name()
+        record = {
+            'file': os.path.basename(path),
+            'name': name,
+            'test': normalize_test_name(test_name) if test_name else None,
+            'combination': combination or get_current_combination(),
+            'time': time.time(),
+        }
+
+        # single write of whole line in append mode, records of parallel processes do not mix
+        os.makedirs(self.folder, exist_ok=True)
+        with open(self.manifest_path, 'ab') as manifest:
+            manifest.write((json.dumps(record) + '\n').encode('utf-8'))
+
+    def get_test_screenshots(self, test_name, since=None, combination=None):
+        """ Return paths of screenshots taken in given test.
+
+        :param str test_name: name of test function
+        :param float since: return only screenshots taken after given time (e.g. start of test run)
+        :param str combination: return only screenshots taken in given combination (html prefix)
+        :return: list of paths (without duplicates)
+        """
+
+        self.refresh()
+        records = self.by_test.get(normalize_test_name(test_name), [])
+        paths = []
+        for record in records:
+            if since is not None and record['time'] < since:
+                continue
+            if combination is not None and record.get('combination') != combination:
+                continue
+            path = os.path.join(self.folder, record['file'])
+            # identical screenshots share the file (see ScreenshotWriter)
+            if path not in paths:
+                paths.append(path)
+        return paths
+
+
+registries = {}
+registries_lock = threading.Lock()
+
+
+def get_screenshot_registry(folder):
+    """ Return registry of screenshots folder shared by the process. Folder is created if it does not exist.
+
+    :param str folder: screenshots folder
+    :return: ScreenshotRegistry
+    """
+
+    folder = os.path.abspath(folder)
+    with registries_lock:
+        if folder not in registries:
+            os.makedirs(folder, exist_ok=True)
+            registries[folder] = ScreenshotRegistry(folder)
+        return registries[folder]
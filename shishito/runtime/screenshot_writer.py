@@ -0,0 +1,142 @@
+"""
+@summary: Writing of screenshots on background threads. Identical screenshots are stored only once,
+optionally they are recompressed or converted to JPEG/WebP (requires Pillow).
+"""
+import atexit
+import hashlib
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+FORMAT_EXTENSIONS = {'png': 'png', 'jpeg': 'jpg', 'jpg': 'jpg', 'webp': 'webp'}
+
+
+class ScreenshotWriter(object):
+    """ Writes screenshots (PNG data from driver) to files.
+
+    :param str image_format: None to write PNG data as they are, 'png' to recompress PNG,
+     'jpeg' or 'webp' to convert (Pillow is required for all formats)
+    :param int quality: quality of JPEG/WebP images (1-100)
+    :param bool asynchronous: write on background thread (see flush)
+    """
+
+    def __init__(self, image_format=None, quality=None, asynchronous=True):
+        image_format = (image_format or '').lower() or None
+        if image_format and image_format not in FORMAT_EXTENSIONS:
+            raise ValueError('Unknown screenshot format: %s' % image_format)
+        if image_format and Image is None:
+            print('Pillow is not installed, screenshots are saved as PNG without recompression')
+            image_format = None
+
+        self.image_format = image_format
+        self.quality = int(quality) if quality else None
+        self.asynchronous = asynchronous
+        self.extension = FORMAT_EXTENSIONS[image_format] if image_format else 'png'
+        self.written = {}
+        self.futures = []
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def encode(self, png_data):
+        """ Return image data in configured format. """
+
+        if not self.image_format:
+            return png_data
+
+        image = Image.open(BytesIO(png_data))
+        output = BytesIO()
+        if self.image_format == 'png':
+            image.save(output, 'PNG', optimize=True)
+        elif self.image_format == 'webp':
+            image.save(output, 'WEBP', quality=self.quality or 80)
+        else:
+            image.convert('RGB').save(output, 'JPEG', quality=self.quality or 85, optimize=True)
+        return output.getvalue()
+
+    def write_file(self, png_data, path):
+        with open(path, 'wb') as image_file:
+            image_file.write(self.encode(png_data))
+
+    def write(self, png_data, path):
+        """ Write screenshot to path (on background thread if writer is asynchronous).
+
+        :param bytes png_data: screenshot in PNG format (WebDriver.get_screenshot_as_png)
+        :param path: path of the image (extension should be self.extension) or function returning the path,
+         called only if there is no identical screenshot
+        :return: path of the image - path of previously written identical screenshot if there is one
+        """
+
+        digest = hashlib.sha1(png_data).hexdigest()
+        with self.lock:
+            written_path, future = self.written.get(digest, (None, None))
+            # identical screenshot is written (or being written) already
+            if written_path and ((future and not future.done()) or os.path.exists(written_path)):
+                return written_path
+
+            if callable(path):
+                path = path()
+            future = None
+            if self.asynchronous:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=2)
+                future = self.executor.submit(self.write_file, png_data, path)
+                self.futures.append(future)
+            self.written[digest] = (path, future)
+
+        if not future:
+            self.write_file(png_data, path)
+        return path
+
+    def flush(self):
+        """ Wait until all screenshots are written. Errors are printed. """
+
+        with self.lock:
+            futures, self.futures = self.futures, []
+
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                print('Saving of screenshot failed:')
+                traceback.print_exc()
+
+
+screenshot_writer = None
+writer_lock = threading.Lock()
+
+
+def get_screenshot_writer(shishito_support=None):
+    """ Return screenshot writer of the process, configured on first call by settings "screenshot_format",
+    "screenshot_quality" and "screenshot_async".
+
+    :param ShishitoSupport shishito_support: support object for getting config values
+    :return: ScreenshotWriter
+    """
+
+    global screenshot_writer
+
+    with writer_lock:
+        if screenshot_writer is None:
+            if shishito_support:
+                get_opt = shishito_support.get_opt
+                screenshot_writer = ScreenshotWriter(
+                    get_opt('screenshot_format'), get_opt('screenshot_quality'),
+                    str(get_opt('screenshot_async', default='true')).lower() == 'true')
+            else:
+                screenshot_writer = ScreenshotWriter()
+        return screenshot_writer
+
+
+@atexit.register
+def flush_screenshots():
+    """ Wait until screenshots being written are saved. """
+
+    if screenshot_writer is not None:
+        screenshot_writer.flush()
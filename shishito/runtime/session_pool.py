@@ -0,0 +1,298 @@
+"""
+@summary: Pool of webdriver sessions reused by test classes running in the same process
+"""
+import atexit
+import threading
+import time
+
+# max seconds get() waits for a driver being prefetched before it starts its own
+PREFETCH_WAIT_TIMEOUT = 300
+
+# max seconds close() waits for prefetch threads, drivers started later are quit by the threads
+CLOSE_TIMEOUT = 10
+
+
+class PooledSession(object):
+    """ Webdriver session kept in the session pool.
+
+    :param tuple key: key of the pool the session belongs to (see SessionPool.get_key)
+    :param WebDriver driver: started webdriver
+    :param ShishitoEnvironment environment: environment which started the driver (releases its resources on quit)
+    :param float startup_time: seconds it took to start the driver
+    """
+
+    def __init__(self, key, driver, environment, startup_time):
+        self.key = key
+        self.driver = driver
+        self.environment = environment
+        self.startup_time = startup_time
+        self.created = time.time()
+        self.uses = 0
+
+
+class SessionPool(object):
+    """ Hands out started webdrivers to test classes. Driver returned by a test class is reset
+    (extra windows closed, cookies and storage cleared, about:blank loaded) and given to the next class
+    with the same key, so browser is not started again for every test class.
+    Drivers can be also started ahead on background threads (see prefetch).
+
+    :param float max_age: max age of session in seconds, older sessions are quit (None for no limit)
+    :param int max_uses: max number of test classes using one session (None for no limit)
+    """
+
+    def __init__(self, max_age=None, max_uses=None):
+        self.max_age = max_age
+        self.max_uses = max_uses
+        self.reuse = True
+        self.idle = {}
+        self.in_use = {}
+        self.pending = {}
+        self.threads = []
+        self.lock = threading.Condition()
+
+        # set by close(), stops prefetch threads (and their waiting for browser slots, see stop_event)
+        self.stop_event = threading.Event()
+        self.generation = 0
+
+        # max number of drivers started by the pool (None for no limit), bounds prefetching
+        self.start_limit = None
+        self.started = 0
+
+        self.reused = 0
+        self.prefetched = 0
+        self.time_saved = 0.0
+
+    @staticmethod
+    def get_key(environment, config_section):
+        """ Return pool key - sessions started for the same environment and config section
+        have the same capabilities and can be shared.
+
+        :param str environment: test environment (local, browserstack, ...)
+        :param str config_section: section in platform/environment.properties config
+        :return: tuple
+        """
+
+        return environment, config_section
+
+    def configure(self, max_age=None, max_uses=None, reuse=True):
+        self.reuse = reuse
+        self.max_age = float(max_age) if max_age else None
+        self.max_uses = int(max_uses) if max_uses else None
+
+    def is_expired(self, session):
+        if self.max_age and time.time() - session.created >= self.max_age:
+            return True
+        if self.max_uses and session.uses >= self.max_uses:
+            return True
+        return False
+
+    @staticmethod
+    def is_healthy(driver):
+        """ Check that the browser session still responds. """
+
+        if driver.session_id is None:
+            return False
+        try:
+            driver.current_url
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def reset_driver(driver):
+        """ Bring browser to clean state for the next test class.
+
+        :param WebDriver driver: driver to reset
+        """
+
+        handles = driver.window_handles
+        for handle in handles[1:]:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(handles[0])
+
+        # storage is accessible only from the page of the tested site, clear it before leaving
+        try:
+            driver.execute_script('window.localStorage.clear(); window.sessionStorage.clear();')
+        except Exception:
+            pass
+        driver.delete_all_cookies()
+        driver.get('about:blank')
+
+    @staticmethod
+    def quit_session(session):
+        try:
+            session.driver.quit()
+        except Exception:
+            pass
+        session.environment.release_browser(session.driver)
+
+    def get(self, key, environment, start_driver):
+        """ Return driver for given key - idle session from the pool, or new one started by start_driver.
+
+        :param tuple key: pool key (see get_key)
+        :param ShishitoEnvironment environment: environment starting the driver
+        :param start_driver: function without arguments returning new webdriver
+        :return: WebDriver
+        """
+
+        session = self.take_idle(key)
+        if session:
+            if session.uses:
+                self.reused += 1
+            else:
+                self.prefetched += 1
+            self.time_saved += session.startup_time
+        else:
+            with self.lock:
+                self.started += 1
+            start = time.time()
+            driver = start_driver()
+            session = PooledSession(key, driver, environment, time.time() - start)
+
+        session.uses += 1
+        with self.lock:
+            self.in_use[id(session.driver)] = session
+        return session.driver
+
+    def take_idle(self, key):
+        """ Remove healthy idle session for given key from the pool, quit expired and broken ones.
+
+        :param tuple key: pool key (see get_key)
+        :return: PooledSession or None
+        """
+
+        deadline = time.monotonic() + PREFETCH_WAIT_TIMEOUT
+        while True:
+            with self.lock:
+                # driver being prefetched will be ready sooner than a new one
+                while not self.idle.get(key) and self.pending.get(key):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or self.stop_event.is_set():
+                        break
+                    self.lock.wait(remaining)
+
+                sessions = self.idle.get(key)
+                if not sessions:
+                    return None
+                session = sessions.pop()
+
+            if not self.is_expired(session) and self.is_healthy(session.driver):
+                return session
+            self.quit_session(session)
+
+    def put(self, driver):
+        """ Return driver to the pool. Driver is reset, or quit if it is expired or reset fails.
+
+        :param WebDriver driver: driver obtained from get()
+        :return: True if driver was handled by the pool, False if driver does not come from the pool
+        """
+
+        with self.lock:
+            session = self.in_use.pop(id(driver), None)
+        if session is None:
+            return False
+
+        if not self.reuse or self.is_expired(session):
+            self.quit_session(session)
+            return True
+
+        try:
+            self.reset_driver(driver)
+        except Exception:
+            self.quit_session(session)
+            return True
+
+        with self.lock:
+            self.idle.setdefault(session.key, []).append(session)
+        return True
+
+    def prefetch(self, key, environment, start_driver, count):
+        """ Start drivers on background threads, so that given number of drivers is ready
+        (idle or being started) for the next get() with the same key.
+
+        :param tuple key: pool key (see get_key)
+        :param ShishitoEnvironment environment: environment starting the drivers
+        :param start_driver: function without arguments returning new webdriver
+        :param int count: number of drivers to keep ready
+        """
+
+        with self.lock:
+            if self.stop_event.is_set():
+                return
+            missing = count - len(self.idle.get(key, [])) - self.pending.get(key, 0)
+            if self.start_limit is not None:
+                missing = min(missing, self.start_limit - self.started)
+            if missing <= 0:
+                return
+            self.pending[key] = self.pending.get(key, 0) + missing
+            self.started += missing
+
+        for _ in range(missing):
+            thread = threading.Thread(target=self.prefetch_driver,
+                                      args=(key, environment, start_driver, self.generation, self.stop_event))
+            thread.daemon = True
+            self.threads.append(thread)
+            thread.start()
+
+    def prefetch_driver(self, key, environment, start_driver, generation, stop_event):
+        """ Start driver and add it to idle sessions (background thread started by prefetch).
+        Driver started after the pool was closed is quit. """
+
+        session = None
+        if not stop_event.is_set():
+            start = time.time()
+            try:
+                session = PooledSession(key, start_driver(), environment, time.time() - start)
+            except BaseException:  # environments call sys.exit() when browser can not be started
+                pass
+
+        with self.lock:
+            if generation == self.generation:
+                self.pending[key] -= 1
+                if session:
+                    self.idle.setdefault(key, []).insert(0, session)
+                    session = None
+                self.lock.notify_all()
+
+        # pool was closed meanwhile
+        if session:
+            self.quit_session(session)
+
+    def close(self):
+        """ Stop prefetching, wait (up to CLOSE_TIMEOUT) for drivers being started and quit all idle sessions. """
+
+        with self.lock:
+            threads, self.threads = self.threads, []
+            stop_event, self.stop_event = self.stop_event, threading.Event()
+            stop_event.set()
+            # drivers of running prefetch threads are not added to the pool any more, threads quit them
+            self.generation += 1
+            self.pending.clear()
+            self.lock.notify_all()
+
+        deadline = time.monotonic() + CLOSE_TIMEOUT
+        for thread in threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        if any(thread.is_alive() for thread in threads):
+            print('Some browsers are still starting, they will be quit when started')
+
+        with self.lock:
+            sessions = [session for sessions in self.idle.values() for session in sessions]
+            self.idle.clear()
+
+        for session in sessions:
+            self.quit_session(session)
+
+        if self.reused or self.prefetched:
+            print('Webdriver sessions reused %s times, %s prefetched, saved %.1f seconds of browser startup'
+                  % (self.reused, self.prefetched, self.time_saved))
+        self.reused = 0
+        self.prefetched = 0
+        self.time_saved = 0.0
+        self.started = 0
+        self.start_limit = None
+
+
+session_pool = SessionPool()
+atexit.register(session_pool.close)
@@ -0,0 +1,125 @@
+"""
+@summary: State shared by all processes of the test run (combination workers, xdist workers)
+"""
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class FileLock(object):
+    """ Lock shared by processes on the same machine and threads using the same FileLock object.
+    Uses flock() where available, otherwise exclusive creation of the lock file.
+
+    :param str path: path to lock file
+    :param float poll_interval: seconds between attempts to get the lock (without flock)
+    """
+
+    def __init__(self, path, poll_interval=0.05):
+        self.path = path
+        self.poll_interval = poll_interval
+        # file lock is held by one thread of the process at a time, lock_file belongs to that thread
+        self.thread_lock = threading.Lock()
+        self.lock_file = None
+
+    def acquire(self):
+        """ Wait until lock is acquired. """
+
+        self.thread_lock.acquire()
+        try:
+            lock_folder = os.path.dirname(self.path)
+            if lock_folder and not os.path.exists(lock_folder):
+                os.makedirs(lock_folder, exist_ok=True)
+            self.lock_file = self.lock_path()
+        except BaseException:
+            self.thread_lock.release()
+            raise
+
+    def lock_path(self):
+        """ Wait until lock file is locked by current process.
+
+        :return: locked file object (flock) or file descriptor
+        """
+
+        if fcntl:
+            lock_file = open(self.path, 'a')
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                lock_file.close()
+                raise
+            return lock_file
+
+        while True:
+            try:
+                return os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                time.sleep(self.poll_interval)
+
+    def release(self):
+        """ Release the lock. """
+
+        lock_file, self.lock_file = self.lock_file, None
+        try:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+                lock_file.close()
+            else:
+                os.close(lock_file)
+                os.remove(self.path)
+        finally:
+            self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.release()
+
+
+class SharedState(object):
+    """ JSON document in a file, modified by several processes. Every change is done under file lock
+    and the file is replaced atomically, so it can be read without the lock.
+
+    :param str path: path to state file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = FileLock(path + '.lock')
+
+    def read(self):
+        """ Return current state.
+
+        :return: dict with state (empty if state file does not exist yet)
+        """
+
+        try:
+            with open(self.path) as state_file:
+                return json.load(state_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def update(self, function):
+        """ Change state under lock.
+
+        :param function: function called with state dict, which it can modify in place
+        :return: value returned by the function
+        """
+
+        with self.lock:
+            state = self.read()
+            result = function(state)
+
+            temp_path = '%s.%s.%s.tmp' % (self.path, os.getpid(), threading.get_ident())
+            with open(temp_path, 'w') as state_file:
+                json.dump(state, state_file)
+            os.replace(temp_path, self.path)
+
+        return result
@@ -1,4 +1,5 @@
 import os
+import threading
 from importlib import import_module
 
 import pytest
@@ -10,6 +11,74 @@ else:
     configparser = ConfigParser
 
 
+def is_project_root(path):
+    """ Return True if path is test project root (contains config and tests directories). """
+
+    return os.path.exists(os.path.join(path, 'config')) and os.path.exists(os.path.join(path, 'tests'))
+
+
+class ConfigStore(object):
+    """ Configuration files parsed once per process and shared by all ShishitoSupport objects.
+    File is parsed again when its modification time or size changes. Parsed configs are shared,
+    so they must not be modified.
+    """
+
+    def __init__(self):
+        self.files = {}
+        self.project_roots = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_file_key(path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get_config(self, path):
+        """ Return parsed .properties file (empty config if file does not exist).
+
+        :param str path: path to config file
+        :return: tuple (ConfigParser, dict with variables of DEFAULT section)
+        """
+
+        key = self.get_file_key(path)
+        with self.lock:
+            cached = self.files.get(path)
+            if cached and cached[0] == key:
+                return cached[1]
+
+        config = configparser.ConfigParser()
+        config.read(path)
+        parsed = (config, dict(config.defaults()))
+        with self.lock:
+            self.files[path] = (key, parsed)
+        return parsed
+
+    def find_project_root(self):
+        """ Return project root found on sys.path (remembered while sys.path does not change).
+
+        :return: path or None
+        """
+
+        search_path = tuple(sys.path)
+        with self.lock:
+            project_root = self.project_roots.get(search_path)
+        if project_root and is_project_root(project_root):
+            return project_root
+
+        for path in search_path:
+            if is_project_root(path):
+                with self.lock:
+                    self.project_roots[search_path] = path
+                return path
+        return None
+
+
+config_store = ConfigStore()
+
+
 class ShishitoSupport(object):
     """ Support class for getting config values and importing modules according to
     test platform and environment.
@@ -46,13 +115,10 @@ class ShishitoSupport(object):
         :raises ValueError: if config directory is not found on sys.path
         """
 
-        for path in sys.path:
-            config_dir = os.path.join(path, 'config')
-            tests_dir = os.path.join(path, 'tests')
-            if os.path.exists(config_dir) and os.path.exists(tests_dir):
-                return path
-
-        raise ValueError('Can not find config dir on sys.path')
+        project_root = config_store.find_project_root()
+        if not project_root:
+            raise ValueError('Can not find config dir on sys.path')
+        return project_root
 
     def load_configs(self):
         """ Load variables from .properties configuration files. If local_execution is true in local_config file, function
@@ -68,18 +134,14 @@ class ShishitoSupport(object):
 
         configs = []
 
-        # load server config variables
-        config = configparser.ConfigParser()
+        # load server config variables (files are parsed once per process, see ConfigStore)
         server_config = os.path.join(config_path, 'server_config.properties')
-        config.read(server_config)
-        server_config_vars = dict(config.defaults())
+        server_config_vars = config_store.get_config(server_config)[1]
         configs.append((server_config_vars, 'server config'))
 
         # load local config variables
-        config = configparser.ConfigParser()
         local_config = os.path.join(config_path, 'local_config.properties')
-        config.read(local_config)
-        local_config_vars = dict(config.defaults())
+        local_config_vars = config_store.get_config(local_config)[1]
 
         if local_config_vars.get('local_execution').lower() == 'true':
             configs.insert(0, (local_config_vars, 'local config'))
@@ -149,14 +211,12 @@ class ShishitoSupport(object):
         :raises ValueError: if config path does not exist
         """
 
-        config = configparser.ConfigParser()
         config_path = os.path.join(self.project_root, 'config', self.test_platform, self.test_environment + '.properties')
 
         if not os.path.exists(config_path):
             raise ValueError('Config file in location {0} was not found!'.format(config_path))
 
-        config.read(config_path)
-        return config
+        return config_store.get_config(config_path)[0]
 
     def get_module(self, module):
         """ Import object from given module according to current test platform and environment.
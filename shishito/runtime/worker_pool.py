@@ -0,0 +1,230 @@
+"""
+@summary: Pool of pre-warmed worker processes for running pytest
+"""
+import multiprocessing
+import sys
+import traceback
+from importlib import import_module
+from multiprocessing.connection import wait
+
+# imported once before workers are forked (import errors are ignored)
+DEFAULT_PRELOAD_MODULES = (
+    'pytest',
+    'xdist.plugin',
+    'selenium.webdriver',
+    'shishito.conf.conftest',
+    'shishito.reporting.junithtml',
+    'shishito.ui.selenium_support',
+)
+
+# start method running tasks in current process, one after another (no isolation of tasks)
+INLINE_START_METHOD = 'inline'
+
+
+class WorkerError(Exception):
+    """ Task raised exception in worker process (message contains its traceback). """
+
+
+class WorkerDied(WorkerError):
+    """ Worker process ended without returning result of its task (killed by signal, OOM killer, ...). """
+
+
+def run_task(connection, function, args):
+    """ Entry point of worker process - run task and send its result to parent process. """
+
+    try:
+        result = (True, function(*args))
+    except BaseException:
+        result = (False, traceback.format_exc())
+    connection.send(result)
+    connection.close()
+
+
+class WorkerTask(object):
+    """ Task submitted to WorkerPool.
+
+    :param WorkerPool pool: pool running the task
+    :param function: function to run
+    :param tuple args: arguments of the function
+    """
+
+    def __init__(self, pool, function, args):
+        self.pool = pool
+        self.function = function
+        self.args = args
+        self.process = None
+        self.connection = None
+        self.done = False
+        self.result = None
+        self.error = None
+
+    def finish(self, result=None, error=None):
+        self.done = True
+        self.result = result
+        self.error = error
+
+    def get(self):
+        """ Wait for result of the task.
+
+        :return: value returned by the function
+        :raises WorkerError: if function raised exception
+        :raises WorkerDied: if worker process died
+        """
+
+        while not self.done:
+            self.pool.wait_for_tasks()
+        if self.error:
+            raise self.error
+        return self.result
+
+
+class WorkerPool(object):
+    """ Runs tasks (pytest.main() calls) in fresh worker processes forked from a process in which pytest, selenium
+    and project modules (e.g. page objects) are already imported. Every task gets its own process, so plugin state
+    or imported test modules do not leak from one task into the next one, while imports are paid only once.
+    Worker processes are not daemonic, so tasks can start processes of their own (e.g. pytest-xdist workers).
+
+    With 'fork' start method (default where available) modules are imported in current process, with 'forkserver'
+    they are imported by fork server process. 'spawn' starts cold interpreter for every task (no preloading).
+    'inline' runs tasks in current process one after another, without any isolation.
+
+    :param int processes: max number of tasks running at the same time
+    :param list preload_modules: additional modules to import before workers are forked
+    :param str start_method: multiprocessing start method (fork, forkserver, spawn) or 'inline'
+    :param str project_root: test project root (added to sys.path, so that project modules can be preloaded)
+    """
+
+    def __init__(self, processes=1, preload_modules=None, start_method=None, project_root=None):
+        self.processes = processes
+        self.preload_modules = list(preload_modules or [])
+        self.start_method = start_method or self.get_default_start_method()
+        self.project_root = project_root
+        self.context = None
+        self.queued = []
+        self.running = []
+
+    @staticmethod
+    def get_default_start_method():
+        """ Return 'fork' if supported by platform, otherwise 'spawn'. """
+
+        if 'fork' in multiprocessing.get_all_start_methods():
+            return 'fork'
+        return 'spawn'
+
+    def preload(self, context):
+        """ Import preload modules into process from which the workers are started.
+
+        :param context: multiprocessing context
+        """
+
+        if self.project_root and self.project_root not in sys.path:
+            sys.path.insert(0, self.project_root)
+
+        if self.start_method == 'forkserver':
+            context.set_forkserver_preload(list(DEFAULT_PRELOAD_MODULES) + self.preload_modules)
+        elif self.start_method == 'fork':
+            for module in DEFAULT_PRELOAD_MODULES:
+                try:
+                    import_module(module)
+                except ImportError:
+                    pass    # optional module
+
+            for module in self.preload_modules:
+                try:
+                    import_module(module)
+                except Exception as e:
+                    print('Unable to preload module %s: %s' % (module, e))
+
+    def start(self):
+        """ Preload modules for worker processes. """
+
+        self.context = multiprocessing.get_context(self.start_method)
+        self.preload(self.context)
+
+    def submit(self, function, *args):
+        """ Run function in worker process (as soon as less than max number of tasks is running).
+
+        :return: WorkerTask
+        """
+
+        task = WorkerTask(self, function, args)
+        self.queued.append(task)
+        return task
+
+    def run(self, function, *args):
+        """ Run function in worker process and wait for its result. """
+
+        return self.submit(function, *args).get()
+
+    def start_tasks(self):
+        """ Start queued tasks while there are free processes. """
+
+        if self.start_method == INLINE_START_METHOD:
+            if self.queued:
+                task = self.queued.pop(0)
+                try:
+                    task.finish(result=task.function(*task.args))
+                except Exception:
+                    task.finish(error=WorkerError(traceback.format_exc()))
+            return
+
+        if self.context is None:
+            self.start()
+
+        while self.queued and len(self.running) < max(self.processes, 1):
+            task = self.queued.pop(0)
+            receiver, sender = self.context.Pipe(duplex=False)
+            task.process = self.context.Process(target=run_task, args=(sender, task.function, task.args))
+            task.process.daemon = False
+            task.process.start()
+            sender.close()
+            task.connection = receiver
+            self.running.append(task)
+
+    def wait_for_tasks(self):
+        """ Start queued tasks and wait until some running task finishes. """
+
+        self.start_tasks()
+        if not self.running:
+            return
+
+        # result is sent before the process ends; process ending without result died
+        ready = wait([task.connection for task in self.running] + [task.process.sentinel for task in self.running])
+        for task in self.running[:]:
+            if task.connection not in ready and task.process.sentinel not in ready:
+                continue
+
+            try:
+                success, value = task.connection.recv()
+            except (EOFError, OSError):
+                task.process.join()
+                task.finish(error=WorkerDied('Worker process running %s died with exit code %s'
+                                             % (task.function.__name__, task.process.exitcode)))
+            else:
+                task.process.join()
+                if success:
+                    task.finish(result=value)
+                else:
+                    task.finish(error=WorkerError(value))
+            task.connection.close()
+            self.running.remove(task)
+
+    def close(self):
+        """ Stop all worker processes, queued tasks are not run. """
+
+        for task in self.running:
+            task.process.terminate()
+        for task in self.running:
+            task.process.join()
+            task.connection.close()
+            task.finish(error=WorkerDied('Worker pool was closed'))
+        for task in self.queued:
+            task.finish(error=WorkerDied('Worker pool was closed'))
+        self.running = []
+        self.queued = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
@@ -2,13 +2,26 @@
 @author: Irina
 @summary: Functions that operate over BrowserStack API
 """
+import itertools
 import json
+import os
 import requests
 import sys
 import time
 
+from shishito.runtime.shared_state import SharedState
+
 
 class BrowserStackAPI(object):
+    """ BrowserStack Automate REST API
+
+    :param str api_url: base url of the API (e.g. url of local stub server)
+    """
+
+    API_URL = 'https://www.browserstack.com/automate'
+
+    def __init__(self, api_url=None):
+        self.api_url = (api_url or self.API_URL).rstrip('/')
 
     def request_get_verify(self, auth, url):
         '''
@@ -35,7 +48,7 @@ class BrowserStackAPI(object):
         raise ConnectionError('Cannot get valid response from Browserstack. Latest status code = {0}'.format(response.status_code))
 
     def get_projects(self, auth):
-        url = "https://www.browserstack.com/automate/projects.json"
+        url = self.api_url + "/projects.json"
         r = self.request_get_verify(auth, url)
         return r.json()
 
@@ -44,12 +57,12 @@ class BrowserStackAPI(object):
         for project in self.get_projects(auth):
             if project['automation_project']['name'] == project_name:
                 project_id = project['automation_project']['id']
-                url = "https://browserstack.com/automate/projects/%s.json" % project_id
+                url = self.api_url + "/projects/%s.json" % project_id
                 r = self.request_get_verify(auth, url)
                 return r.json()
 
     def get_builds(self, auth):
-        url = "https://www.browserstack.com/automate/builds.json"
+        url = self.api_url + "/builds.json"
         r = self.request_get_verify(auth, url)
         return r.json()
 
@@ -60,7 +73,7 @@ class BrowserStackAPI(object):
 
     def get_sessions(self, auth, build_name):
         hashed_id = self.get_build_hash_id(auth, build_name)
-        url = "https://www.browserstack.com/automate/builds/%s/sessions.json" % hashed_id
+        url = self.api_url + "/builds/%s/sessions.json" % hashed_id
         r = self.request_get_verify(auth, url)
         return r.json()
 
@@ -79,16 +92,19 @@ class BrowserStackAPI(object):
     def get_session_hashed_id(self, session):
         return session['hashed_id'] if session else None
 
-    def is_session_available(self, auth):
-        url = "https://www.browserstack.com/automate/plan.json"
+    def get_plan(self, auth):
+        url = self.api_url + "/plan.json"
         r = self.request_get_verify(auth, url)
-        session = r.json()
+        return r.json()
+
+    def is_session_available(self, auth):
+        session = self.get_plan(auth)
         session_running = session["parallel_sessions_running"]
         session_all = session["parallel_sessions_max_allowed"]
         return int(session_all) - int(session_running)
 
     def change_status(self, auth, session_id):
-        url = "https://www.browserstack.com/automate/sessions/%s.json" % session_id
+        url = self.api_url + "/sessions/%s.json" % session_id
         status = {'status': 'error'}
         headers = {'content-type': 'application/json'}
         requests.put(url, auth=auth, data=json.dumps(status), headers=headers)
@@ -107,3 +123,150 @@ class BrowserStackAPI(object):
             time.sleep(int(wait_delay) * 60)
             session_available = self.is_session_available(auth)
         return session_available
+
+
+class SessionDispatcher(object):
+    """ Hands out BrowserStack parallel session slots to all processes of the test run on this machine
+    (combination workers, xdist workers). Slots are leased in a shared state file under file lock, so processes do not
+    race for the same free session. The plan (parallel_sessions_max_allowed / running) is fetched from BrowserStack
+    by one process at a time and reused by the others until it is older than plan_refresh. When a slot is released,
+    waiting process gets it within poll_interval without asking BrowserStack.
+
+    :param BrowserStackAPI bs_api: BrowserStack API object
+    :param tuple auth: BrowserStack credentials (user, token)
+    :param str state_file: path to file with shared slot state
+    :param float poll_interval: seconds between attempts to get a slot
+    :param float plan_refresh: max age of cached plan in seconds
+    """
+
+    lease_counter = itertools.count()
+
+    def __init__(self, bs_api, auth, state_file, poll_interval=0.5, plan_refresh=10):
+        self.bs_api = bs_api
+        self.auth = auth
+        self.state = SharedState(state_file)
+        self.poll_interval = poll_interval
+        self.plan_refresh = plan_refresh
+
+    @staticmethod
+    def get_process_start_time(pid):
+        """ Return start time of process (in clock ticks since boot, from /proc), None if it is not known.
+        Together with pid it identifies the process, pids of dead processes are reused. """
+        try:
+            with open('/proc/%d/stat' % pid) as stat_file:
+                stat = stat_file.read()
+        except (IOError, OSError):
+            return None
+        # process name (in parentheses) can contain spaces, start time is 22nd field
+        return int(stat[stat.rindex(')') + 2:].split()[19])
+
+    @classmethod
+    def is_process_alive(cls, pid, start_time=None):
+        """ Return False if process with given pid (and start time) does not exist any more
+        (leases of dead processes are dropped).
+
+        :param int pid: process id
+        :param int start_time: start time of the process (see get_process_start_time), None if not known
+        """
+        if os.name != 'posix':
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+
+        # pid was reused by another process
+        current_start_time = cls.get_process_start_time(pid)
+        return start_time is None or current_start_time is None or current_start_time == start_time
+
+    def get_free_slots(self, state, now):
+        """ Return number of free slots, refresh cached plan if needed.
+
+        :param dict state: shared slot state
+        :param float now: current time
+        :return: int with number of free slots
+        """
+        leases = state.setdefault('leases', {})
+        for lease_id, lease in list(leases.items()):
+            if not self.is_process_alive(lease['pid'], lease.get('start_time')):
+                del leases[lease_id]
+
+        plan = state.get('plan')
+        if not plan or now - plan['time'] > self.plan_refresh:
+            response = self.bs_api.get_plan(self.auth)
+            plan = {
+                'max_allowed': int(response['parallel_sessions_max_allowed']),
+                'running': int(response['parallel_sessions_running']),
+                'time': now,
+            }
+            state['plan'] = plan
+
+        # sessions of leases acquired before the plan was fetched are (probably) included in running sessions,
+        # as well as sessions of leases released since then
+        counted_leases = len([lease for lease in leases.values() if lease['time'] < plan['time']])
+        other_sessions = max(0, plan['running'] - counted_leases - plan.get('released', 0))
+        return plan['max_allowed'] - other_sessions - len(leases)
+
+    def try_acquire(self, state):
+        """ Lease a slot if there is any free one.
+
+        :param dict state: shared slot state
+        :return: lease id or None
+        """
+        now = time.time()
+        if self.get_free_slots(state, now) <= 0:
+            return None
+
+        lease_id = '%s-%s' % (os.getpid(), next(self.lease_counter))
+        state['leases'][lease_id] = {
+            'pid': os.getpid(),
+            'start_time': self.get_process_start_time(os.getpid()),
+            'time': now,
+        }
+        return lease_id
+
+    def acquire(self, timeout, stop_event=None):
+        """ Wait for free BrowserStack session slot.
+
+        :param float timeout: max time to wait in seconds
+        :param threading.Event stop_event: stops waiting when set (e.g. browser prefetch of aborted run)
+        :return: lease id (to be passed to release()) or None if no slot got free
+        """
+        deadline = time.time() + timeout
+        waiting_reported = False
+        while True:
+            lease_id = self.state.update(self.try_acquire)
+            if lease_id:
+                return lease_id
+
+            if time.time() >= deadline:
+                return None
+
+            if not waiting_reported:
+                print('No BrowserStack session available. Waiting up to %s seconds...' % int(timeout))
+                waiting_reported = True
+            if stop_event is None:
+                time.sleep(self.poll_interval)
+            elif stop_event.wait(self.poll_interval):
+                return None
+
+    def release(self, lease_id):
+        """ Free session slot.
+
+        :param str lease_id: lease id returned by acquire()
+        """
+        self.state.update(lambda state: self.remove_lease(state, lease_id))
+
+    @staticmethod
+    def remove_lease(state, lease_id):
+        """ Remove lease from shared slot state.
+
+        :param dict state: shared slot state
+        :param str lease_id: lease id returned by acquire()
+        """
+        lease = state.get('leases', {}).pop(lease_id, None)
+        plan = state.get('plan')
+        if lease and plan and lease['time'] < plan['time']:
+            plan['released'] = plan.get('released', 0) + 1
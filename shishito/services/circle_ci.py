@@ -5,6 +5,7 @@
 """
 import requests
 import json
+from shishito.runtime.downloader import get_downloader
 from shishito.runtime.shishito_support import ShishitoSupport
 import os
 
@@ -24,21 +25,24 @@ class CircleAPI(object):
         if not os.path.exists(destination_folder):
             os.makedirs(destination_folder)
         artifact_data = self.get_artifact_data()
-        for artifact in artifact_data:
-            self.save_artifact(artifact, destination_folder)
+        # artifacts are downloaded in parallel, unchanged artifacts downloaded before are skipped
+        get_downloader().download_all([self.get_artifact_download(artifact, destination_folder)
+                                       for artifact in artifact_data])
         return bool(os.listdir(destination_folder))
 
-    def save_artifact(self, artifact, destination_folder):
-        """ saves artifact into specified folder """
+    def get_artifact_download(self, artifact, destination_folder):
+        """ returns arguments of Downloader.download() for artifact """
         file_name = artifact['url'].split('/')[-1]
-        file_request_url = artifact['url'] + '?circle-token=' + self.api_token
-
-        response = requests.get(file_request_url, stream=True)
-        response.raise_for_status()
+        return {
+            'url': artifact['url'],
+            'file_path': os.path.join(destination_folder, file_name),
+            'params': {'circle-token': self.api_token},
+            'manifest': True,
+        }
 
-        with open(os.path.join(destination_folder, file_name), 'wb') as extension:
-            for block in response.iter_content(1024):
-                extension.write(block)
+    def save_artifact(self, artifact, destination_folder):
+        """ saves artifact into specified folder """
+        get_downloader().download(**self.get_artifact_download(artifact, destination_folder))
 
     def get_artifact_data(self):
         """returns json with artifact urls"""
@@ -75,6 +75,19 @@ class ShishitoRunner(object):
                             help='Specify build number for reporting purposes')
         parser.add_argument('--maxfail',
                             help='stop after x failures')
+        parser.add_argument('--failure_budget',
+                            help='stop the whole test run (all combinations) after x failures')
+        parser.add_argument('--parallel_combinations',
+                            help='Max number of browser/device combinations running at the same time')
+        parser.add_argument('--last_failed', '--last-failed',
+                            help='Rerun only tests that failed in previous run (for each combination)',
+                            action='store_true')
+        parser.add_argument('--failed_first', '--failed-first',
+                            help='Run tests that failed in previous run first',
+                            action='store_true')
+        parser.add_argument('--shard',
+                            help='Run only part of the tests (e.g. on one of several CI nodes); '
+                                 'format: "INDEX/COUNT", INDEX starts from 0')
         args = parser.parse_args()
 
         # return args dict --> for use in other classes
@@ -89,6 +102,11 @@ class ShishitoRunner(object):
             sys.exit('The runner cannot be executed directly.'
                      ' You need to import it within project specific runner. Session terminated.')
 
+        # failed tests of previous run have to be read before results are cleaned up
+        failed_tests = None
+        if self.shishito_support.get_opt('last_failed') or self.shishito_support.get_opt('failed_first'):
+            failed_tests = self.reporter.get_failed_tests()
+
         # cleanup previous results
         self.reporter.cleanup_results()
 
@@ -96,6 +114,7 @@ class ShishitoRunner(object):
         executor_class = self.shishito_support.get_module('platform_execution')
         # executor_class = getattr(import_module(platform_path), 'ControlExecution')
         executor = executor_class(self.shishito_support, self.test_timestamp)
+        executor.failed_tests = failed_tests
 
         # run test
         exit_code = executor.run_tests()
@@ -104,6 +123,10 @@ class ShishitoRunner(object):
         self.reporter.archive_results()
         self.reporter.generate_combined_report()
 
+        # remember test durations for scheduling of next runs (results of crashed combinations are skipped)
+        if executor.is_duration_history_used():
+            executor.update_duration_history(self.reporter.get_xunit_test_cases(self.test_timestamp, skip_invalid=True))
+
         # upload results to QAStats test management app
         qastats_credentials = self.shishito_support.get_opt('qastats')
         if qastats_credentials:
@@ -0,0 +1,182 @@
+"""
+@summary: JavaScript executed in browser by SeleniumTest helpers.
+Element lookup mirrors selenium locator strategies (By.ID, By.XPATH, ...), so the same (By, value) locators
+can be used in scripts.
+"""
+
+# functions shared by the scripts below (prepend to script)
+HELPERS_JS = r"""
+function shishitoFindElements(by, value, root) {
+    root = root || document;
+    var list;
+    switch (by) {
+        case 'id':
+            list = root.querySelectorAll('[id="' + value.replace(/(["\\])/g, '\\$1') + '"]');
+            break;
+        case 'name':
+            list = root.querySelectorAll('[name="' + value.replace(/(["\\])/g, '\\$1') + '"]');
+            break;
+        case 'class name':
+            list = root.getElementsByClassName(value);
+            break;
+        case 'tag name':
+            list = root.getElementsByTagName(value);
+            break;
+        case 'css selector':
+            list = root.querySelectorAll(value);
+            break;
+        case 'link text':
+        case 'partial link text':
+            var links = root.getElementsByTagName('a');
+            var found = [];
+            for (var i = 0; i < links.length; i++) {
+                var text = shishitoGetText(links[i]);
+                if (by == 'link text' ? text == value : text.indexOf(value) != -1) {
+                    found.push(links[i]);
+                }
+            }
+            return found;
+        case 'xpath':
+            var snapshot = document.evaluate(value, root, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+            var nodes = [];
+            for (var j = 0; j < snapshot.snapshotLength; j++) {
+                nodes.push(snapshot.snapshotItem(j));
+            }
+            return nodes;
+        default:
+            throw new Error('Unsupported locator strategy: ' + by);
+    }
+    return Array.prototype.slice.call(list);
+}
+
+function shishitoIsVisible(element) {
+    var style = window.getComputedStyle(element);
+    if (style.visibility == 'hidden' || style.display == 'none' || style.opacity == '0') {
+        return false;
+    }
+    return !!(element.offsetWidth || element.offsetHeight || element.getClientRects().length);
+}
+
+function shishitoGetText(element) {
+    return (element.innerText || '').trim();
+}
+
+function shishitoGetAttribute(element, name) {
+    // like WebElement.get_attribute: property value if there is one, attribute otherwise
+    var value = element[name];
+    if (value === undefined || value === null || typeof value == 'object' || typeof value == 'function') {
+        value = element.getAttribute(name);
+    }
+    return value === null ? null : String(value);
+}
+"""
+
+# resolves when condition on element at locator is met (checked on every DOM mutation and periodically,
+# for changes which are not mutations - e.g. stylesheets), or with false when timeout expires
+# arguments: by, value, condition, expected value, attribute name, timeout (ms), poll interval (ms), callback
+WAIT_FOR_CONDITION_SCRIPT = HELPERS_JS + r"""
+var by = arguments[0], value = arguments[1], condition = arguments[2], expected = arguments[3],
+    attribute = arguments[4], timeout = arguments[5], pollInterval = arguments[6],
+    callback = arguments[arguments.length - 1];
+
+function check() {
+    var element = shishitoFindElements(by, value)[0];
+    switch (condition) {
+        case 'present':
+            return !!element;
+        case 'not_present':
+            return !element;
+        case 'visible':
+            return !!element && shishitoIsVisible(element);
+        case 'not_visible':
+            return !element || !shishitoIsVisible(element);
+        case 'text':
+            return !!element && shishitoGetText(element) == expected;
+        case 'attribute':
+            return !!element && shishitoGetAttribute(element, attribute) == expected;
+    }
+    throw new Error('Unknown condition: ' + condition);
+}
+
+if (check()) {
+    callback(true);
+} else {
+    var done = false;
+    var observer = new MutationObserver(function () {
+        if (!done && check()) {
+            finish(true);
+        }
+    });
+    var poll = setInterval(function () {
+        if (!done && check()) {
+            finish(true);
+        }
+    }, pollInterval);
+    var timer = setTimeout(function () {
+        finish(check());
+    }, timeout);
+
+    function finish(result) {
+        done = true;
+        observer.disconnect();
+        clearInterval(poll);
+        clearTimeout(timer);
+        callback(result);
+    }
+
+    observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+}
+"""
+
+# return properties of all elements at locator as list of plain objects
+# arguments: by, value, list of attribute names
+ELEMENTS_PROPERTIES_SCRIPT = HELPERS_JS + r"""
+var attributes = arguments[2] || [];
+return shishitoFindElements(arguments[0], arguments[1]).map(function (element) {
+    var visible = shishitoIsVisible(element);
+    var rect = element.getBoundingClientRect();
+    var values = {};
+    for (var i = 0; i < attributes.length; i++) {
+        values[attributes[i]] = shishitoGetAttribute(element, attributes[i]);
+    }
+    return {
+        element: element,
+        tag_name: element.tagName.toLowerCase(),
+        // like WebElement.text, hidden elements have no text
+        text: visible ? shishitoGetText(element) : '',
+        visible: visible,
+        attributes: values,
+        rect: {x: rect.left + window.pageXOffset, y: rect.top + window.pageYOffset,
+               width: rect.width, height: rect.height}
+    };
+});
+"""
+
+# resolve list of [by, value] locators, return presence and first element for each
+PREFETCH_LOCATORS_SCRIPT = HELPERS_JS + r"""
+return arguments[0].map(function (locator) {
+    var element = shishitoFindElements(locator[0], locator[1])[0];
+    return {
+        present: !!element,
+        element: element || null
+    };
+});
+"""
+
+# check all images of the page in browser, return sources of those which are not loaded
+IMAGES_NOT_LOADED_SCRIPT = """
+var images = document.getElementsByTagName('img');
+var notLoaded = [];
+var pending = 0;
+for (var i = 0; i < images.length; i++) {
+    var image = images[i];
+    if (!image.complete) {
+        pending++;
+    }
+    if (image.getAttribute('src') && !(image.complete && typeof image.naturalWidth != "undefined"
+                                       && image.naturalWidth > 0)) {
+        notLoaded.push(image.src);
+    }
+}
+return {title: document.title, notLoaded: notLoaded, pending: pending};
+"""
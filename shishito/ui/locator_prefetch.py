@@ -0,0 +1,81 @@
+"""
+@summary: Prefetch of page object locators. Presence and first element of all locators of a page are resolved
+by one script. The snapshot is not refreshed - the caller decides how long it is valid (e.g. until the next action
+on the page) and prefetches again after the page changes.
+"""
+from shishito.ui.browser_scripts import PREFETCH_LOCATORS_SCRIPT
+
+
+class LocatorSnapshot(object):
+    """ Presence and first element of locators at the moment of prefetch.
+
+    :param list names: names of prefetched locators
+    :param list elements: result of PREFETCH_LOCATORS_SCRIPT (in order of names)
+    """
+
+    def __init__(self, names, elements):
+        self.entries = dict(zip(names, elements))
+
+    def is_present(self, name):
+        """ True if element of the locator was present in the DOM at the moment of prefetch.
+
+        :raises KeyError: if the locator was not prefetched
+        """
+
+        return self.entries[name]['present']
+
+    def get_element(self, name):
+        """ Return first element (WebElement) of the locator, None if it was not present.
+
+        :raises KeyError: if the locator was not prefetched
+        """
+
+        return self.entries[name]['element']
+
+    def get_presence(self):
+        """ Return dict {locator name: True if element was present}. """
+
+        return dict((name, entry['present']) for name, entry in self.entries.items())
+
+
+def prefetch_locators(driver, locators):
+    """ Resolve all locators by one script.
+
+    :param WebDriver driver: webdriver
+    :param dict locators: {name: (By, value) locator}
+    :return: LocatorSnapshot
+    """
+
+    names = list(locators)
+    elements = driver.execute_script(PREFETCH_LOCATORS_SCRIPT, [list(locators[name]) for name in names])
+    return LocatorSnapshot(names, elements)
+
+
+class PrefetchedPage(object):
+    """ Mixin for page objects which declare their locators in class attribute "locators".
+    Page object must have "driver" attribute.
+
+        class LoginPage(PrefetchedPage):
+            locators = {
+                'username': (By.ID, 'username'),
+                'submit': (By.CSS_SELECTOR, 'form button'),
+            }
+
+            def __init__(self, driver):
+                self.driver = driver
+
+        snapshot = login_page.prefetch()    # one request for all locators
+        if snapshot.is_present('username'):  # no request
+            ...
+        snapshot.get_element('submit').is_displayed()  # visibility is checked live by WebDriver
+    """
+
+    locators = {}
+
+    def prefetch(self):
+        """ Resolve all locators of the page by one script.
+
+        :return: LocatorSnapshot
+        """
+
+        return prefetch_locators(self.driver, self.locators)
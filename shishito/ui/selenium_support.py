@@ -8,43 +8,210 @@ Helper functions that abstract often basic webdriver operations into more usable
 import inspect
 import time
 import os
-import glob
+from contextlib import contextmanager
 
-import requests
 from selenium.webdriver.support.ui import Select
 from selenium.common.exceptions import NoSuchElementException, \
-    ElementNotVisibleException, TimeoutException
+    ElementNotVisibleException, TimeoutException, WebDriverException
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.common.keys import Keys
 from unittestzero import Assert
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.action_chains import ActionChains
 
+from shishito.runtime.downloader import get_downloader
+from shishito.runtime.file_watcher import wait_for_files
+from shishito.runtime.screenshot_registry import get_screenshot_registry
+from shishito.runtime.screenshot_writer import get_screenshot_writer
 from shishito.runtime.shishito_support import ShishitoSupport
+from shishito.ui.browser_scripts import ELEMENTS_PROPERTIES_SCRIPT, IMAGES_NOT_LOADED_SCRIPT, \
+    WAIT_FOR_CONDITION_SCRIPT
+from shishito.ui.visual_baseline import compare_images, get_baseline_store, image_from_png, image_to_png
+
+
+class ImplicitWaitTracker(object):
+    """ Remembers implicit wait set on the driver and skips implicitly_wait commands which would not change it.
+    Replaces driver.implicitly_wait, use get_implicit_wait_tracker() to create it.
+
+    :param WebDriver driver: tracked driver
+    """
+
+    def __init__(self, driver):
+        self.implicitly_wait = driver.implicitly_wait
+        self.value = None   # unknown until set
+        self.requested = None
+        self.suspended = 0
+
+    def set(self, time_to_wait):
+        """ Set implicit wait; inside no_implicit_wait() it is set when the outermost context ends. """
+        if self.suspended:
+            self.requested = time_to_wait
+        else:
+            self.apply(time_to_wait)
+
+    def apply(self, time_to_wait):
+        time_to_wait = float(time_to_wait)
+        if time_to_wait != self.value:
+            self.implicitly_wait(time_to_wait)
+            self.value = time_to_wait
+
+    @contextmanager
+    def no_implicit_wait(self, restore=None):
+        """ Context with implicit wait turned off, previous value is set back when it ends.
+
+        :param float restore: implicit wait to set at the end if previous value is not known
+        """
+        if not self.suspended:
+            self.requested = self.value if self.value is not None else restore
+            self.apply(0)
+        self.suspended += 1
+        try:
+            yield
+        finally:
+            self.suspended -= 1
+            if not self.suspended and self.requested is not None:
+                self.apply(self.requested)
+
+
+def get_implicit_wait_tracker(driver):
+    """ Return implicit wait tracker of the driver, create it on the first call.
+
+    :param WebDriver driver: webdriver
+    :return: ImplicitWaitTracker
+    """
+    tracker = getattr(driver, 'implicit_wait_tracker', None)
+    if tracker is None:
+        tracker = ImplicitWaitTracker(driver)
+        driver.implicit_wait_tracker = tracker
+        driver.implicitly_wait = tracker.set
+    return tracker
+
+
+# parts of error messages of drivers which do not support a command at all (e.g. scripts in native context
+# of mobile application), as opposed to errors of the particular call (page unloaded, invalid XPath, ...)
+UNSUPPORTED_COMMAND_MESSAGES = ('unknown command', 'unknown method', 'not implemented', 'not supported')
+
+
+def is_unsupported_command(error):
+    """ Return True if WebDriverException means that the driver does not support the command.
+
+    :param WebDriverException error: error raised by the command
+    :return: bool
+    """
+    if type(error).__name__ == 'UnknownMethodException':
+        return True
+    message = (getattr(error, 'msg', None) or str(error)).lower()
+    return any(text in message for text in UNSUPPORTED_COMMAND_MESSAGES)
 
 
 class SeleniumTest(object):
     def __init__(self, driver):
         self.driver = driver
+        self.implicit_wait_tracker = get_implicit_wait_tracker(driver)
         self.shishito_support = ShishitoSupport()
         self.base_url = self.shishito_support.get_opt('base_url')
         self.default_implicit_wait = int(self.shishito_support.get_opt('default_implicit_wait'))
         self.timeout = int(self.shishito_support.get_opt('timeout'))
 
+        # polling of wait_for_* functions: starts at poll_interval, grows by poll_backoff up to poll_max_interval
+        self.poll_interval = float(self.shishito_support.get_opt('wait_poll_interval', default=0.1))
+        self.poll_max_interval = float(self.shishito_support.get_opt('wait_poll_max_interval', default=1))
+        self.poll_backoff = float(self.shishito_support.get_opt('wait_poll_backoff', default=1.5))
+
     def save_screenshot(self, name=None, project_root=None):
         """ Saves application screenshot """
         if not name:
             # Use the name of browser and caller function (e.g. 'chrome_test_google_search'
             name = self.driver.name + "_" + inspect.stack()[1][3]
+        self.save_screenshot_data(self.driver.get_screenshot_as_png(), name, project_root)
+
+    def save_screenshot_data(self, png_data, name, project_root=None):
+        """ Save PNG image as screenshot of current test (shown in HTML report).
+
+        :param bytes png_data: image in PNG format
+        :param str name: screenshot name
+        :param str project_root: test project root (default from config)
+        :return: path of saved screenshot
+        """
         if not project_root:
             project_root = self.shishito_support.project_root
-        screenshot_folder = os.path.join(project_root, 'screenshots')
-        if not os.path.exists(screenshot_folder):
-            os.makedirs(screenshot_folder)
+        # screenshots are numbered and assigned to the current test and combination by the registry
+        registry = get_screenshot_registry(os.path.join(project_root, 'screenshots'))
+        # image is encoded and written in background, identical screenshots are stored once
+        writer = get_screenshot_writer(self.shishito_support)
+        reserved_paths = []
+
+        def reserve_path():
+            reserved_paths.append(registry.reserve(name, writer.extension))
+            return reserved_paths[-1]
+
+        screenshot_path = writer.write(png_data, reserve_path)
+        if not reserved_paths:
+            # identical screenshot was saved before
+            registry.register(screenshot_path, name)
+        return screenshot_path
+
+    def get_screenshot_region(self, region):
+        """ Return region of page as (x, y, width, height) in pixels of the screenshot (viewport).
+
+        :param region: WebElement, locator (By, value) or (x, y, width, height) in CSS pixels of the page
+        :return: tuple
+        """
+        if hasattr(region, 'rect'):
+            rect = region.rect
+        elif len(region) == 2:
+            rect = self.driver.find_element(*region).rect
+        else:
+            rect = dict(zip(('x', 'y', 'width', 'height'), region))
+
+        scale, scroll_x, scroll_y = self.driver.execute_script(
+            'return [window.devicePixelRatio || 1, window.pageXOffset, window.pageYOffset];')
+        return ((rect['x'] - scroll_x) * scale, (rect['y'] - scroll_y) * scale,
+                rect['width'] * scale, rect['height'] * scale)
+
+    def assert_matches_baseline(self, name, region=None, ignore=(), max_diff_ratio=None, pixel_threshold=None):
+        """ Compare screenshot with baseline image stored for current environment section
+        (baselines/<section>/<name>.png in project root). Missing baseline is created from the screenshot,
+        baselines are overwritten when "visual_update_baselines" is True. Requires numpy and Pillow.
+
+        If screenshot does not match, the screenshot and diff image (different pixels red, ignored regions blue)
+        are saved to screenshots of the test (shown in HTML report).
+
+        :param str name: baseline name
+        :param region: compared part of the page - WebElement, locator or (x, y, width, height) (default viewport)
+        :param list ignore: regions not compared (WebElements, locators or rects, e.g. ads or clocks)
+        :param float max_diff_ratio: max ratio of different pixels (default "visual_max_diff_ratio" or 0)
+        :param int pixel_threshold: max difference of color channel considered the same
+         (default "visual_pixel_threshold" or 0)
+        :raises AssertionError: if screenshot does not match baseline
+        """
+        get_opt = self.shishito_support.get_opt
+        if max_diff_ratio is None:
+            max_diff_ratio = float(get_opt('visual_max_diff_ratio', default=0))
+        if pixel_threshold is None:
+            pixel_threshold = int(get_opt('visual_pixel_threshold', default=0))
+
+        image = image_from_png(self.driver.get_screenshot_as_png())
+        ignore_regions = [self.get_screenshot_region(ignored) for ignored in ignore]
+        if region is not None:
+            x, y, width, height = (int(round(value)) for value in self.get_screenshot_region(region))
+            image = image.crop((x, y, x + width, y + height))
+            ignore_regions = [(ignore_x - x, ignore_y - y, ignore_width, ignore_height)
+                              for ignore_x, ignore_y, ignore_width, ignore_height in ignore_regions]
+
+        store = get_baseline_store(self.shishito_support.project_root, get_opt('environment_configuration'))
+        baseline = store.load(name)
+        if baseline is None or str(get_opt('visual_update_baselines', default='false')).lower() == 'true':
+            store.save(name, image)
+            print('Baseline %s saved (%s)' % (name, store.get_path(name)))
+            return
 
-        existing_images = glob.glob(os.path.join(screenshot_folder, name + '_*.png'))
-        actual_pic_nr = len(existing_images) + 1
-        self.driver.save_screenshot(os.path.join(screenshot_folder, '{}_{}.png'.format(name, actual_pic_nr)))
+        comparison = compare_images(image, baseline, ignore_regions, pixel_threshold, max_diff_ratio)
+        if not comparison.matches:
+            self.save_screenshot_data(image_to_png(image), name + '_actual')
+            if comparison.diff_image is not None:
+                self.save_screenshot_data(image_to_png(comparison.diff_image), name + '_diff')
+            raise AssertionError('Screenshot does not match baseline %s: %s' % (name, comparison.message))
 
     def save_file_from_url(self, file_path, url):
         """ Saves file from url """
@@ -52,14 +219,8 @@ class SeleniumTest(object):
             print('File %s already exists.' % file_path)
             return
 
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-
-        with open(file_path, 'wb') as save_file:
-            for block in response.iter_content(1024):
-                if not block:
-                    break
-                save_file.write(block)
+        # interrupted download is resumed
+        get_downloader().download(url, file_path)
 
     # Deprecated use property directly
     def get_base_url(self):
@@ -93,30 +254,53 @@ class SeleniumTest(object):
             self.driver.implicitly_wait(10)
 
     def check_images_are_loaded(self):
-        """ checks all images on the pages and verifies if they are properly loaded """
-        script = 'return arguments[0].complete && typeof arguments[0].naturalWidth' \
-                 ' != "undefined" && arguments[0].naturalWidth > 0'
-        images_not_loaded = []
-        for image in self.driver.find_elements_by_tag_name('img'):
-            loaded = self.driver.execute_script(script, image)
-            if not loaded and image.get_attribute('src'):
-                images_not_loaded.append('%s: %s' % (self.driver.title, image.get_attribute('src')))
-        return images_not_loaded
+        """ checks all images on the pages and verifies if they are properly loaded
+        (all images are checked by one script in browser)
+
+        :return: list of '<page title>: <image src>' for images which are not loaded
+        """
+        result = self.driver.execute_script(IMAGES_NOT_LOADED_SCRIPT)
+        return ['%s: %s' % (result['title'], src) for src in result['notLoaded']]
+
+    def wait_for_images_to_load(self, timeout=None):
+        """ waits until browser finishes loading of all images on the page (or timeout expires),
+        then checks that they are properly loaded
+
+        :param float timeout: seconds to wait (default setting "timeout")
+        :return: list of '<page title>: <image src>' for images which are not loaded
+        """
+        result = self.wait_until(self.get_loaded_images_result, timeout)
+        if not result:
+            # some images are still loading
+            result = self.driver.execute_script(IMAGES_NOT_LOADED_SCRIPT)
+        return ['%s: %s' % (result['title'], src) for src in result['notLoaded']]
+
+    def get_loaded_images_result(self):
+        """ Return result of IMAGES_NOT_LOADED_SCRIPT if no image is loading, None otherwise. """
+        result = self.driver.execute_script(IMAGES_NOT_LOADED_SCRIPT)
+        return None if result['pending'] else result
+
+    def no_implicit_wait(self):
+        """ Context with implicit wait of the driver turned off. Nested contexts and implicitly_wait calls
+        inside the context do not send any commands to the driver, implicit wait is set back once it ends.
+
+            with self.no_implicit_wait():
+                while not self.is_element_present(locator):
+                    ...
+        """
+        return self.implicit_wait_tracker.no_implicit_wait(restore=self.default_implicit_wait)
 
     def is_element_present(self, locator):
         """
         True if the element at the specified locator is present in the DOM.
         Note: It returns false immediately if the element is not found.
         """
-        self.driver.implicitly_wait(0)
-        try:
-            self.driver.find_element(*locator)
-            return True
-        except NoSuchElementException:
-            return False
-        finally:
-            # set the implicit wait back
-            self.driver.implicitly_wait(self.default_implicit_wait)
+        with self.no_implicit_wait():
+            try:
+                self.driver.find_element(*locator)
+                return True
+            except NoSuchElementException:
+                return False
 
     def is_element_visible(self, locator):
         """
@@ -133,63 +317,149 @@ class SeleniumTest(object):
         True if the element at the specified locator is not visible.
         Note: It returns true immediately if the element is not found.
         """
-        self.driver.implicitly_wait(0)
-        try:
-            return not self.driver.find_element(*locator).is_displayed()
-        except (NoSuchElementException, ElementNotVisibleException):
-            return True
-        finally:
-            # set the implicit wait back
-            self.driver.implicitly_wait(self.default_implicit_wait)
+        with self.no_implicit_wait():
+            try:
+                return not self.driver.find_element(*locator).is_displayed()
+            except (NoSuchElementException, ElementNotVisibleException):
+                return True
+
+    def wait_until(self, condition, timeout=None, poll_interval=None):
+        """ Call condition until it returns true value or timeout expires.
+        Implicit wait is turned off while polling, so every check returns immediately.
+
+        :param condition: function without arguments
+        :param float timeout: seconds to wait (default setting "timeout")
+        :param float poll_interval: first delay between checks (default setting "wait_poll_interval"),
+         delay grows by "wait_poll_backoff" up to "wait_poll_max_interval"
+        :return: value returned by condition, False if timeout expired
+        """
+        timeout = timeout or self.timeout
+        interval = poll_interval or self.poll_interval
+        deadline = time.monotonic() + timeout
+
+        with self.no_implicit_wait():
+            while True:
+                value = condition()
+                if value:
+                    return value
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(interval, remaining))
+                interval = min(interval * self.poll_backoff, max(self.poll_max_interval, interval))
 
     def wait_for_element_present(self, locator, timeout=None):
         """ Wait for the element at the specified locator
         to be present in the DOM. """
-        timeout = timeout or self.timeout
-        count = 0
-        while not self.is_element_present(locator):
-            time.sleep(1)
-            count += 1
-            if count == timeout:
-                raise Exception('{0} has not loaded'.format(locator))
+        if not self.wait_until(lambda: self.is_element_present(locator), timeout):
+            raise Exception('{0} has not loaded'.format(locator))
 
     def wait_for_element_visible(self, locator, timeout=None):
         """
         Wait for the element at the specified locator to be visible.
         """
-        timeout = timeout or self.timeout
-        count = 0
-        while not self.is_element_visible(locator):
-            time.sleep(1)
-            count += 1
-            if count == timeout:
-                raise Exception("{0} is not visible".format(locator))
+        if not self.wait_until(lambda: self.is_element_visible(locator), timeout):
+            raise Exception("{0} is not visible".format(locator))
 
     def wait_for_element_not_visible(self, locator, timeout=None):
         """
         Wait for the element at the specified locator not to be visible anymore.
         """
-        timeout = timeout or self.timeout
-        count = 0
-        while self.is_element_visible(locator):
-            time.sleep(1)
-            count += 1
-            if count == timeout:
-                raise Exception("{0} is still visible".format(locator))
+        if not self.wait_until(lambda: not self.is_element_visible(locator), timeout):
+            raise Exception("{0} is still visible".format(locator))
 
     def wait_for_element_not_present(self, locator, timeout=None):
         """ Wait for the element at the specified locator
          not to be present in the DOM. """
-        timeout = timeout or self.timeout
-        self.driver.implicitly_wait(0)
-        try:
-            WebDriverWait(self.driver, timeout).until(
-                lambda s: len(self.find_elements(*locator)) < 1)
-            return True
-        except TimeoutException:
+        if not self.wait_until(lambda: len(self.find_elements(locator)) < 1, timeout):
             Assert.fail(TimeoutException)
-        finally:
-            self.driver.implicitly_wait(self.default_implicit_wait)
+        return True
+
+    def wait_in_browser(self, condition, locator, timeout=None, expected=None, attribute=None, fallback=None):
+        """ Wait until condition on element at locator is met. Waiting runs in browser as one async script,
+        which checks the condition whenever DOM changes, instead of polling with a request for every check.
+        Drivers without async script support poll the fallback function, after failed script it polls
+        for the rest of the timeout.
+
+        :param str condition: present, not_present, visible, not_visible, text (expected text)
+         or attribute (expected value of attribute)
+        :param tuple locator: (By, value) locator of the element
+        :param float timeout: seconds to wait (default setting "timeout")
+        :param str expected: expected element text or attribute value
+        :param str attribute: name of the attribute
+        :param fallback: function without arguments checking the condition from python
+        :return: True if condition was met
+        """
+        timeout = timeout or self.timeout
+        deadline = time.monotonic() + timeout
+        if getattr(self.driver, 'async_script_supported', True):
+            self.set_script_timeout(timeout + 5)
+            try:
+                return bool(self.driver.execute_async_script(
+                    WAIT_FOR_CONDITION_SCRIPT, locator[0], locator[1], condition, expected, attribute,
+                    int(timeout * 1000), int(self.poll_interval * 1000)))
+            except TimeoutException:
+                return False
+            except WebDriverException as e:
+                # other errors (e.g. page unloaded during the wait) fall back only for this call
+                if is_unsupported_command(e):
+                    self.driver.async_script_supported = False
+        # condition is checked at least once, even if the script used up the whole timeout
+        return bool(self.wait_until(fallback, max(deadline - time.monotonic(), 0.001)))
+
+    def set_script_timeout(self, timeout):
+        """ Make sure async scripts of the driver can run for given number of seconds. """
+        if getattr(self.driver, 'async_script_timeout', 0) < timeout:
+            self.driver.set_script_timeout(timeout)
+            self.driver.async_script_timeout = timeout
+
+    def get_element_property(self, locator, get_property):
+        """ Return property of element at locator (None if there is no element) without implicit wait. """
+        with self.no_implicit_wait():
+            try:
+                return get_property(self.driver.find_element(*locator))
+            except NoSuchElementException:
+                return None
+
+    def wait_for_element_present_in_browser(self, locator, timeout=None):
+        """ Wait for the element at the specified locator to be present in the DOM (see wait_in_browser). """
+        if not self.wait_in_browser('present', locator, timeout, fallback=lambda: self.is_element_present(locator)):
+            raise Exception('{0} has not loaded'.format(locator))
+
+    def wait_for_element_not_present_in_browser(self, locator, timeout=None):
+        """ Wait for the element at the specified locator not to be present in the DOM (see wait_in_browser). """
+        if not self.wait_in_browser('not_present', locator, timeout,
+                                    fallback=lambda: not self.is_element_present(locator)):
+            raise Exception('{0} is still present'.format(locator))
+
+    def wait_for_element_visible_in_browser(self, locator, timeout=None):
+        """ Wait for the element at the specified locator to be visible (see wait_in_browser). """
+        if not self.wait_in_browser('visible', locator, timeout, fallback=lambda: self.is_element_visible(locator)):
+            raise Exception("{0} is not visible".format(locator))
+
+    def wait_for_element_not_visible_in_browser(self, locator, timeout=None):
+        """ Wait for the element at the specified locator not to be visible anymore (see wait_in_browser). """
+        if not self.wait_in_browser('not_visible', locator, timeout,
+                                    fallback=lambda: not self.is_element_visible(locator)):
+            raise Exception("{0} is still visible".format(locator))
+
+    def wait_for_text_in_browser(self, text, locator, timeout=None):
+        """ Wait for text of the element at the specified locator to match text (see wait_in_browser). """
+        if not self.wait_in_browser('text', locator, timeout, expected=text,
+                                    fallback=lambda: self.get_element_property(locator, lambda e: e.text) == text):
+            raise Exception('"{0}" text did not match text of {1} after {2} seconds'.format(
+                text, locator, timeout or self.timeout))
+
+    def wait_for_attribute_value_in_browser(self, attribute, attribute_text, locator, timeout=None):
+        """ Wait for attribute of the element at the specified locator to match text (see wait_in_browser). """
+        def fallback():
+            return self.get_element_property(locator, lambda e: e.get_attribute(attribute)) == attribute_text
+
+        if not self.wait_in_browser('attribute', locator, timeout, expected=attribute_text, attribute=attribute,
+                                    fallback=fallback):
+            raise Exception('"{0}" text did not match "{1}" attribute of {2} after {3} seconds'.format(
+                attribute_text, attribute, locator, timeout or self.timeout))
 
     def wait_for_text_to_match(self, text, locator, max_count=20, delay=0.25):
         """ Waits for element text to match specified text, until certain deadline """
@@ -234,10 +504,32 @@ class SeleniumTest(object):
         """ Return a list of elements at the specified locator."""
         return self.driver.find_elements(*locator)
 
+    def get_elements_properties(self, locator, attributes=()):
+        """ Return properties of all elements at the specified locator, fetched by one script.
+
+            rows = self.get_elements_properties((By.CSS_SELECTOR, 'table tr'), attributes=['id'])
+            ids = [row['attributes']['id'] for row in rows if row['visible']]
+
+        :param tuple locator: (By, value) locator of the elements
+        :param list attributes: names of attributes to fetch (values as from WebElement.get_attribute)
+        :return: list of dicts with keys element (WebElement), tag_name, text, visible, attributes (dict)
+         and rect (dict with x, y, width, height)
+        """
+        return self.driver.execute_script(ELEMENTS_PROPERTIES_SCRIPT, locator[0], locator[1], list(attributes))
+
     def find_elements_with_text(self, text, locator):
         """ Find elements that have specified text """
-        elements = self.driver.find_elements(*locator)
-        selected = [item for item in elements if item.text == text]
+        selected = None
+        if getattr(self.driver, 'script_supported', True):
+            try:
+                selected = [item['element'] for item in self.get_elements_properties(locator) if item['text'] == text]
+            except WebDriverException as e:
+                # scripts are not supported (e.g. native mobile application), other errors fall back once
+                if is_unsupported_command(e):
+                    self.driver.script_supported = False
+        if selected is None:
+            elements = self.driver.find_elements(*locator)
+            selected = [item for item in elements if item.text == text]
         return selected[0] if len(selected) == 1 else selected
 
 
@@ -272,14 +564,24 @@ class SeleniumTest(object):
         return self.shishito_support.get_opt('download_path')
 
     def wait_for_file_to_be_downloaded(self, file_path: str, timeout: int = None):
-        timeout = timeout or self.timeout
+        """ Wait until file exists and browser finished its download (no partial .crdownload/.part file).
+        Local folders are watched for changes (inotify), so waiting ends right after the file is renamed
+        to its final name. """
+        self.wait_for_files_to_be_downloaded([file_path], timeout)
+
+    def wait_for_files_to_be_downloaded(self, file_paths, timeout: int = None):
+        """ Wait until all files are downloaded (see wait_for_file_to_be_downloaded).
 
-        while not os.path.exists(file_path):
-            if timeout < 0:
-                raise FileNotFoundError(f'file not found in {timeout} seconds, make sure you specified download_path')
+        :param list file_paths: paths of downloaded files
+        :param int timeout: seconds to wait (default setting "timeout")
+        :raises FileNotFoundError: if some files are not downloaded in time
+        """
+        timeout = timeout or self.timeout
 
-            time.sleep(0.5)
-            timeout -= 0.5
+        missing = wait_for_files(file_paths, timeout)
+        if missing:
+            raise FileNotFoundError(f'file not found in {timeout} seconds, make sure you specified download_path: '
+                                    + ', '.join(missing))
 
     def execute_js_script(self, script, arguments=None):
         """execute any js command with arguments or without it"""
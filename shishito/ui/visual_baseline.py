@@ -0,0 +1,230 @@
+"""
+@summary: Comparison of screenshots with baseline images (visual regression).
+Baselines are PNG files stored per environment section (baselines/<section>/<name>.png in project root).
+Requires numpy and Pillow (pip install shishito[visual]).
+"""
+import os
+import threading
+from io import BytesIO
+
+try:
+    import numpy
+    from PIL import Image
+except ImportError:
+    numpy = None
+    Image = None
+
+HASH_SIZE = 8
+HASH_IMAGE_SIZE = 32
+
+
+def check_dependencies():
+    """ :raises ImportError: if numpy or Pillow is not installed """
+
+    if numpy is None or Image is None:
+        raise ImportError('Visual comparison requires numpy and Pillow (pip install shishito[visual])')
+
+
+def get_dct_matrix(size):
+    """ Return orthonormal DCT-II matrix (dct(x) = matrix @ x). """
+
+    n = numpy.arange(size)
+    matrix = numpy.cos(numpy.pi * (2 * n[None, :] + 1) * n[:, None] / (2.0 * size)) * numpy.sqrt(2.0 / size)
+    matrix[0] /= numpy.sqrt(2)
+    return matrix
+
+
+def get_perceptual_hash(image):
+    """ Return perceptual hash (pHash) of image - bits of lowest DCT frequencies of scaled down grayscale image
+    compared with their median. Similar images have hashes differing in few bits.
+
+    :param PIL.Image.Image image: image
+    :return: int (HASH_SIZE * HASH_SIZE bits)
+    """
+
+    pixels = numpy.asarray(image.convert('L').resize((HASH_IMAGE_SIZE, HASH_IMAGE_SIZE), Image.LANCZOS),
+                           dtype=numpy.float64)
+    dct = get_dct_matrix(HASH_IMAGE_SIZE)
+    frequencies = (dct @ pixels @ dct.T)[:HASH_SIZE, :HASH_SIZE]
+    bits = (frequencies > numpy.median(frequencies[1:, 1:])).flatten()
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+
+def get_hash_distance(first_hash, second_hash):
+    """ Return number of different bits of two perceptual hashes. """
+
+    return bin(first_hash ^ second_hash).count('1')
+
+
+def get_ignore_mask(size, regions):
+    """ Return boolean mask of ignored pixels.
+
+    :param tuple size: (width, height) of image
+    :param list regions: ignored regions (x, y, width, height) in image pixels
+    :return: numpy array (height x width), True for ignored pixels
+    """
+
+    width, height = size
+    mask = numpy.zeros((height, width), dtype=bool)
+    for x, y, region_width, region_height in regions:
+        left, top = max(int(x), 0), max(int(y), 0)
+        mask[top:max(int(y + region_height), 0), left:max(int(x + region_width), 0)] = True
+    return mask
+
+
+class ImageComparison(object):
+    """ Result of image comparison.
+
+    :param bool matches: images match (difference is within limits)
+    :param float diff_ratio: ratio of different pixels (ignored pixels are not counted)
+    :param actual: compared image
+    :param baseline: baseline image
+    :param diff_image: image with different pixels highlighted (None if images are identical or sizes differ)
+    :param str message: description of the difference
+    :param int hash_distance: distance of perceptual hashes of the images, if known
+    """
+
+    def __init__(self, matches, diff_ratio, actual, baseline, diff_image=None, message='', hash_distance=None):
+        self.matches = matches
+        self.diff_ratio = diff_ratio
+        self.actual = actual
+        self.baseline = baseline
+        self.diff_image = diff_image
+        self.message = message
+        self._hash_distance = hash_distance
+
+    @property
+    def hash_distance(self):
+        """ Distance of perceptual hashes of the images (computed on first access). """
+
+        if self._hash_distance is None:
+            self._hash_distance = get_hash_distance(get_perceptual_hash(self.actual),
+                                                    get_perceptual_hash(self.baseline))
+        return self._hash_distance
+
+
+def compare_images(actual, baseline, ignore_regions=(), pixel_threshold=0, max_diff_ratio=0):
+    """ Compare image with baseline pixel by pixel.
+
+    Identical images are detected by single array comparison and skip the per-pixel diff and creation
+    of diff image. Perceptual hashes are computed only for the message of images which do not match
+    (or when ImageComparison.hash_distance is read).
+
+    :param PIL.Image.Image actual: compared image
+    :param PIL.Image.Image baseline: baseline image
+    :param list ignore_regions: regions (x, y, width, height) which are not compared
+    :param int pixel_threshold: max difference of color channel (0-255) of pixels considered the same
+    :param float max_diff_ratio: max ratio of different pixels of matching images
+    :return: ImageComparison
+    """
+
+    check_dependencies()
+
+    if actual.size != baseline.size:
+        comparison = ImageComparison(False, 1.0, actual, baseline)
+        comparison.message = 'image size %sx%s differs from baseline %sx%s, perceptual hash distance %d' \
+                             % (actual.size + baseline.size + (comparison.hash_distance,))
+        return comparison
+
+    actual_pixels = numpy.asarray(actual.convert('RGB'))
+    baseline_pixels = numpy.asarray(baseline.convert('RGB'))
+    if numpy.array_equal(actual_pixels, baseline_pixels):
+        return ImageComparison(True, 0.0, actual, baseline, hash_distance=0)
+
+    difference = numpy.abs(actual_pixels.astype(numpy.int16) - baseline_pixels.astype(numpy.int16)).max(axis=2)
+    different = difference > pixel_threshold
+    ignored = get_ignore_mask(actual.size, ignore_regions)
+    different &= ~ignored
+
+    compared_count = ignored.size - numpy.count_nonzero(ignored)
+    diff_count = numpy.count_nonzero(different)
+    diff_ratio = float(diff_count) / compared_count if compared_count else 0.0
+
+    # faded actual image, different pixels red, ignored regions blue
+    diff_pixels = (actual_pixels * 0.3 + 178).astype(numpy.uint8)
+    diff_pixels[ignored] = (diff_pixels[ignored] * 0.5 + numpy.array([0, 0, 127])).astype(numpy.uint8)
+    diff_pixels[different] = (255, 0, 0)
+
+    comparison = ImageComparison(diff_ratio <= max_diff_ratio, diff_ratio, actual, baseline,
+                                 Image.fromarray(diff_pixels))
+    comparison.message = '%d pixels (%.4f%%) differ from baseline' % (diff_count, diff_ratio * 100)
+    if not comparison.matches:
+        comparison.message += ', perceptual hash distance %d' % comparison.hash_distance
+    return comparison
+
+
+class BaselineStore(object):
+    """ Baseline images of one environment section.
+
+    :param str folder: baselines folder of the section
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def get_path(self, name):
+        return os.path.join(self.folder, name + '.png')
+
+    def load(self, name):
+        """ Return baseline image, None if there is no baseline.
+
+        :param str name: baseline name
+        :return: PIL.Image.Image
+        """
+
+        check_dependencies()
+
+        try:
+            image = Image.open(self.get_path(name))
+        except (IOError, OSError):
+            return None
+        image.load()
+        return image
+
+    def save(self, name, image):
+        """ Store image as baseline.
+
+        :param str name: baseline name
+        :param PIL.Image.Image image: baseline image
+        """
+
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.get_path(name)
+        image.save(path + '.tmp', 'PNG')
+        os.replace(path + '.tmp', path)
+
+
+stores = {}
+stores_lock = threading.Lock()
+
+
+def get_baseline_store(project_root, config_section):
+    """ Return baseline store of environment section shared by the process.
+
+    :param str project_root: test project root
+    :param str config_section: section in platform/environment.properties config
+    :return: BaselineStore
+    """
+
+    folder = os.path.join(os.path.abspath(project_root), 'baselines', config_section or 'default')
+    with stores_lock:
+        if folder not in stores:
+            stores[folder] = BaselineStore(folder)
+        return stores[folder]
+
+
+def image_from_png(png_data):
+    """ Return image from PNG data (e.g. WebDriver.get_screenshot_as_png). """
+
+    check_dependencies()
+    image = Image.open(BytesIO(png_data))
+    image.load()
+    return image
+
+
+def image_to_png(image):
+    """ Return image encoded as PNG. """
+
+    output = BytesIO()
+    image.save(output, 'PNG')
+    return output.getvalue()
@@ -0,0 +1,134 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from shishito.runtime.downloader import Downloader, PARTIAL_SUFFIX
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """ Serves server.content with ETag, Range and If-Range support, records request headers. """
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        content, etag = server.content, '"%s"' % server.version
+
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if range_header and (if_range is None or if_range == etag):
+            start = int(range_header.split('=')[1].rstrip('-'))
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */%d' % len(content))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(content) - 1, len(content)))
+            content = content[start:]
+        else:
+            self.send_response(200)
+
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('Set-Cookie', 'session=secret; Path=/')
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    http_server = HTTPServer(('127.0.0.1', 0), FileHandler)
+    http_server.content = b'0123456789' * 1000
+    http_server.version = 1
+    http_server.requests = []
+    http_server.url = 'http://127.0.0.1:%d/file.bin' % http_server.server_port
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    yield http_server
+    http_server.shutdown()
+    http_server.server_close()
+
+
+def interrupt_download(downloader, server, file_path, size):
+    """ Simulate interrupted download - first size bytes in .part file with validator of current version. """
+
+    with open(file_path + PARTIAL_SUFFIX, 'wb') as partial_file:
+        partial_file.write(server.content[:size])
+    downloader.save_validator(server.url, file_path, '"%s"' % server.version)
+
+
+def test_download(server, tmpdir):
+    file_path = str(tmpdir.join('file.bin'))
+
+    assert Downloader().download(server.url, file_path)
+    with open(file_path, 'rb') as downloaded_file:
+        assert downloaded_file.read() == server.content
+    assert not os.path.exists(file_path + PARTIAL_SUFFIX)
+
+
+def test_resume(server, tmpdir):
+    file_path = str(tmpdir.join('file.bin'))
+    downloader = Downloader()
+    interrupt_download(downloader, server, file_path, 4000)
+
+    downloader.download(server.url, file_path)
+
+    assert server.requests[-1]['Range'] == 'bytes=4000-'
+    assert server.requests[-1]['If-Range'] == '"1"'
+    with open(file_path, 'rb') as downloaded_file:
+        assert downloaded_file.read() == server.content
+
+
+def test_resume_changed_file(server, tmpdir):
+    file_path = str(tmpdir.join('file.bin'))
+    downloader = Downloader()
+    interrupt_download(downloader, server, file_path, 4000)
+    server.content = b'abcdefghij' * 1200
+    server.version = 2
+
+    downloader.download(server.url, file_path)
+
+    # old partial content is not combined with the new version
+    with open(file_path, 'rb') as downloaded_file:
+        assert downloaded_file.read() == server.content
+
+
+def test_resume_without_validator(server, tmpdir):
+    file_path = str(tmpdir.join('file.bin'))
+    with open(file_path + PARTIAL_SUFFIX, 'wb') as partial_file:
+        partial_file.write(b'stale data')
+
+    Downloader().download(server.url, file_path)
+
+    assert 'Range' not in server.requests[-1]
+    with open(file_path, 'rb') as downloaded_file:
+        assert downloaded_file.read() == server.content
+
+
+def test_resume_not_satisfiable(server, tmpdir):
+    file_path = str(tmpdir.join('file.bin'))
+    downloader = Downloader()
+    interrupt_download(downloader, server, file_path, 4000)
+    server.content = server.content[:3000]
+
+    downloader.download(server.url, file_path)
+
+    assert len(server.requests) == 2
+    assert 'Range' not in server.requests[-1]
+    with open(file_path, 'rb') as downloaded_file:
+        assert downloaded_file.read() == server.content
+
+
+def test_cookies_not_shared(server, tmpdir):
+    downloader = Downloader()
+
+    downloader.download(server.url, str(tmpdir.join('first.bin')))
+    downloader.download(server.url, str(tmpdir.join('second.bin')))
+
+    assert 'Cookie' not in server.requests[-1]
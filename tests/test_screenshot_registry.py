@@ -0,0 +1,32 @@
+import threading
+
+from shishito.runtime.screenshot_registry import COMBINATION_ENV, ScreenshotRegistry
+
+
+def test_reserved_paths_are_unique(tmpdir):
+    registries = [ScreenshotRegistry(str(tmpdir)), ScreenshotRegistry(str(tmpdir))]
+    paths = []
+
+    def reserve(registry):
+        for _ in range(10):
+            paths.append(registry.reserve('chrome_test_login', test_name='test_login'))
+
+    threads = [threading.Thread(target=reserve, args=(registries[index % 2],)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(paths)) == 40
+
+
+def test_screenshots_of_combination(tmpdir, monkeypatch):
+    registry = ScreenshotRegistry(str(tmpdir))
+    monkeypatch.setenv(COMBINATION_ENV, '[chrome]')
+    chrome_path = registry.reserve('chrome_test_login', test_name='test_login')
+    monkeypatch.setenv(COMBINATION_ENV, '[firefox]')
+    firefox_path = registry.reserve('chrome_test_login', test_name='test_login')
+
+    assert registry.get_test_screenshots('test_login', combination='[chrome]') == [chrome_path]
+    assert registry.get_test_screenshots('test_login', combination='[firefox]') == [firefox_path]
+    assert registry.get_test_screenshots('test_login') == [chrome_path, firefox_path]
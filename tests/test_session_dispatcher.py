@@ -0,0 +1,153 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from shishito.runtime.shared_state import SharedState
+from shishito.services.browserstack import SessionDispatcher
+
+
+class StubBrowserStackAPI(object):
+    """ BrowserStack API returning given plan, counts plan requests. """
+
+    def __init__(self, max_allowed, running=0):
+        self.max_allowed = max_allowed
+        self.running = running
+        self.plan_requests = 0
+
+    def get_plan(self, auth):
+        self.plan_requests += 1
+        return {'parallel_sessions_max_allowed': self.max_allowed, 'parallel_sessions_running': self.running}
+
+
+@pytest.fixture
+def state_file(tmpdir):
+    return str(tmpdir.join('browserstack_sessions.json'))
+
+
+def get_dispatcher(state_file, bs_api):
+    return SessionDispatcher(bs_api, ('user', 'token'), state_file, poll_interval=0.01)
+
+
+def add_lease(dispatcher, lease_id, pid, start_time):
+    def add(state):
+        state.setdefault('leases', {})[lease_id] = {'pid': pid, 'start_time': start_time, 'time': time.time()}
+    dispatcher.state.update(add)
+
+
+def test_acquire_and_release(state_file):
+    dispatcher = get_dispatcher(state_file, StubBrowserStackAPI(max_allowed=2))
+
+    first = dispatcher.acquire(1)
+    second = dispatcher.acquire(1)
+    assert first and second and first != second
+    assert dispatcher.acquire(0.1) is None
+
+    dispatcher.release(first)
+    assert dispatcher.acquire(0.1)
+
+
+def test_sessions_of_other_runs_are_counted(state_file):
+    dispatcher = get_dispatcher(state_file, StubBrowserStackAPI(max_allowed=2, running=1))
+
+    assert dispatcher.acquire(1)
+    assert dispatcher.acquire(0.1) is None
+
+
+def test_plan_is_shared(state_file):
+    bs_api = StubBrowserStackAPI(max_allowed=5)
+
+    for _ in range(3):
+        get_dispatcher(state_file, bs_api).acquire(1)
+
+    assert bs_api.plan_requests == 1
+
+
+def test_waiting_process_gets_released_slot(state_file):
+    dispatcher = get_dispatcher(state_file, StubBrowserStackAPI(max_allowed=1))
+    lease_id = dispatcher.acquire(1)
+
+    timer = threading.Timer(0.2, dispatcher.release, args=(lease_id,))
+    timer.start()
+    try:
+        assert get_dispatcher(state_file, StubBrowserStackAPI(max_allowed=1)).acquire(5)
+    finally:
+        timer.cancel()
+
+
+def test_lease_of_dead_process_is_dropped(state_file):
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    dispatcher = get_dispatcher(state_file, StubBrowserStackAPI(max_allowed=1))
+    add_lease(dispatcher, 'dead', process.pid, None)
+
+    assert dispatcher.acquire(0.1)
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/stat'), reason='process start time is read from /proc')
+def test_lease_of_reused_pid_is_dropped(state_file):
+    dispatcher = get_dispatcher(state_file, StubBrowserStackAPI(max_allowed=1))
+    start_time = dispatcher.get_process_start_time(os.getpid())
+    add_lease(dispatcher, 'recycled', os.getpid(), start_time - 1)
+
+    assert dispatcher.acquire(0.1)
+
+    # lease of living process is kept
+    assert dispatcher.acquire(0.1) is None
+
+
+def test_stop_event_ends_waiting(state_file):
+    dispatcher = get_dispatcher(state_file, StubBrowserStackAPI(max_allowed=0))
+    stop_event = threading.Event()
+    threading.Timer(0.1, stop_event.set).start()
+
+    start = time.time()
+    assert dispatcher.acquire(30, stop_event=stop_event) is None
+    assert time.time() - start < 5
+
+
+def run_in_threads(function, count=4):
+    threads = [threading.Thread(target=function) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_shared_state_threads(state_file):
+    shared_states = [SharedState(state_file), SharedState(state_file)]
+    errors = []
+
+    def increment(state):
+        state['count'] = state.get('count', 0) + 1
+
+    def update():
+        try:
+            for index in range(20):
+                shared_states[index % 2].update(increment)
+        except Exception as e:
+            errors.append(e)
+
+    run_in_threads(update)
+
+    assert not errors
+    assert shared_states[0].read()['count'] == 80
+
+
+def test_acquire_from_threads(state_file):
+    dispatcher = get_dispatcher(state_file, StubBrowserStackAPI(max_allowed=4))
+    lease_ids = []
+
+    def acquire():
+        for _ in range(10):
+            lease_id = dispatcher.acquire(5)
+            lease_ids.append(lease_id)
+            dispatcher.release(lease_id)
+
+    run_in_threads(acquire)
+
+    assert len(set(lease_ids)) == 40 and None not in lease_ids
+    assert not dispatcher.state.read().get('leases')